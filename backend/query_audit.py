@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Query plan audit for Gestão Oficina Mecânica
+
+Seeds a scratch database, creates the indexes declared in server.py and drives
+the endpoints through the ASGI app, recording every query the server sends
+with a CommandListener. Each distinct query shape is explained and reported
+with its winning plan, keys and documents examined and documents returned; a
+COLLSCAN or a blocking SORT fails the audit unless the shape is a
+whole-collection read by design. New endpoints belong in drive_endpoints()
+below; the queries they issue are picked up from there.
+
+    python query_audit.py [--database NAME] [--documents N] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import bson
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+import server
+from server import Customer, Part, Sale, SaleItem, Service, Setting, fold_text, normalize_phone
+
+AUDIT_DATABASE = "oficina_mecanica_audit"
+AUDIT_DOCUMENTS = 200
+JOBS_DRAIN_SECONDS = 10
+
+# Commands that select documents; anything else (inserts, index builds,
+# server status) has no plan to audit
+AUDITED_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# Fields the driver adds to every command, which explain does not accept
+SESSION_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern",
+                  "$db", "$clusterTime", "$readPreference", "apiVersion", "apiStrict", "apiDeprecationErrors"}
+
+# Empty-filter reads of these collections load them whole on purpose: the
+# catalog caches, the summary over every daily rollup and the job counts in
+# /api/metrics
+WHOLE_COLLECTION_READS = {"parts", "services", "sales_daily", "jobs"}
+# Small by design (one document per setting, per part below the threshold):
+# any plan is fine
+SMALL_COLLECTIONS = {"settings", "low_stock"}
+
+# Keeps a copy of every audited command sent to the audit database while
+# recording is on. Called from the driver's threads.
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self, database: str):
+        self.database = database
+        self.recording = False
+        self.commands: List[dict] = []
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        if not self.recording or event.database_name != self.database:
+            return
+        if event.command_name not in AUDITED_COMMANDS:
+            return
+        command = bson.decode(bson.encode(event.command))
+        with self.lock:
+            self.commands.append(command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# Fills each collection with enough documents for the planner to prefer an
+# index over a scan, built from the same models the endpoints store
+async def seed(db, documents: int) -> dict:
+    start = datetime(2024, 1, 1)
+    customers, parts, services, sales = [], [], [], []
+    
+    for number in range(documents):
+        created_at = start + timedelta(hours=number)
+        customer = Customer(name=f"Cliente {number}", phone=f"(11) 9{number:04d}-0000",
+                            created_at=created_at).model_dump()
+        customer["phone_normalized"] = normalize_phone(customer["phone"])
+        customer["name_folded"] = fold_text(customer["name"])
+        customers.append(customer)
+        
+        parts.append(Part(name=f"Peça {number}", reference_code=f"REF-{number:05d}", cost_price=10,
+                          sale_price=15, stock_quantity=number % 50, created_at=created_at).model_dump())
+        services.append(Service(name=f"Serviço {number}", price=50, created_at=created_at).model_dump())
+        
+        item = SaleItem(type="part", id=parts[-1]["id"], name=parts[-1]["name"], price=15, quantity=1, subtotal=15)
+        sales.append(Sale(sale_number=f"{created_at:%Y%m%d}{number:04d}", date=created_at,
+                          customer_id=customer["id"], items=[item], subtotal_parts=15, subtotal_services=0,
+                          total=15, created_at=created_at).model_dump())
+    
+    for name, rows in (("customers", customers), ("parts", parts), ("services", services), ("sales", sales)):
+        await db[name].insert_many(rows)
+    await db.settings.insert_many([
+        Setting(key=key, value=value).model_dump() for key, value in server.DEFAULT_SETTINGS.items()
+    ])
+    
+    middle = documents // 2
+    return {
+        "customer": customers[middle],
+        "part": parts[middle],
+        "service": services[middle],
+        "sale": sales[middle],
+        "start": start,
+        "end": start + timedelta(days=1),
+    }
+
+# Calls every endpoint that reads or writes MongoDB, following one cursor on
+# the paginated reads. Returns the requests that failed.
+async def drive_endpoints(http: httpx.AsyncClient, sample: dict) -> List[str]:
+    customer, part, service, sale = sample["customer"], sample["part"], sample["service"], sample["sale"]
+    period = {"start_date": f"{sample['start']:%Y-%m-%d}", "end_date": f"{sample['end']:%Y-%m-%d}"}
+    failures = []
+    
+    async def call(method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        response = await http.request(method, url, **kwargs)
+        if response.status_code >= 400:
+            failures.append(f"{method} {url} -> {response.status_code}")
+            return None
+        return response
+    
+    async def paged(url: str, **params):
+        response = await call("GET", url, params={**params, "limit": 10})
+        cursor = response and response.headers.get(server.NEXT_CURSOR_HEADER)
+        if cursor:
+            await call("GET", url, params={**params, "limit": 10, "cursor": cursor})
+    
+    for name in ("customers", "parts", "services", "sales"):
+        await paged(f"/api/{name}")
+    for name in ("customers", "parts", "services"):
+        await call("GET", f"/api/{name}/count")
+    await call("GET", f"/api/customers/{customer['id']}")
+    await call("GET", f"/api/parts/{part['id']}")
+    await call("GET", f"/api/services/{service['id']}")
+    await call("GET", f"/api/sales/{sale['id']}")
+    await call("GET", "/api/customers/search", params={"q": customer["phone"][:8]})
+    await call("GET", "/api/customers/search", params={"q": "cliente 1"})
+    await call("GET", "/api/parts/search", params={"q": "REF-001"})
+    await call("GET", "/api/sales/search", params={"q": sale["sale_number"][:8]})
+    await call("GET", "/api/parts/low-stock")
+    await call("GET", "/api/settings")
+    await call("GET", "/api/reports/summary")
+    await call("GET", "/api/reports/sales", params=period)
+    await paged("/api/reports/sales", include_sales="true", **period)
+    await call("GET", "/api/reports/sales/export", params=period)
+    
+    created = await call("POST", "/api/customers", json={"name": "Auditoria", "phone": "(11) 90000-0000"})
+    if created:
+        customer_id = created.json()["id"]
+        await call("PUT", f"/api/customers/{customer_id}", json={"name": "Auditoria 2", "phone": "(11) 90000-0001"})
+        await call("DELETE", f"/api/customers/{customer_id}")
+    
+    created = await call("POST", "/api/parts", json={"name": "Auditoria", "reference_code": "AUD-1",
+                                                     "cost_price": 1, "sale_price": 2, "stock_quantity": 100})
+    if created:
+        new_part = created.json()
+        await call("PUT", f"/api/parts/{new_part['id']}", json={"stock_quantity": 50})
+        await call("PATCH", "/api/parts/batch", json={"updates": [
+            {"id": new_part["id"], "stock_delta": -1}, {"id": "missing", "stock_delta": 1},
+        ]})
+        item = {"type": "part", "id": new_part["id"], "name": new_part["name"], "price": 2, "quantity": 1,
+                "subtotal": 2}
+        await call("POST", "/api/sales", json={"customer_id": customer["id"], "items": [item]})
+        for _ in range(2):
+            await call("POST", "/api/sales", json={"items": [item]}, headers={"Idempotency-Key": "audit"})
+    await call("POST", "/api/parts/import", headers={"Content-Type": "text/csv"},
+               content="name,reference_code,cost_price,sale_price,stock_quantity\nAuditoria,AUD-2,1,2,3\n")
+    await call("POST", "/api/services", json={"name": "Auditoria", "price": 10})
+    await call("PUT", "/api/settings/low_stock_threshold", json={"value": 6})
+    await call("GET", "/api/metrics")
+    if created:
+        await call("DELETE", f"/api/parts/{created.json()['id']}")
+    return failures
+
+# Waits for the jobs the sales queued, so the worker's queries are recorded
+async def drain_jobs(db):
+    deadline = time.monotonic() + JOBS_DRAIN_SECONDS
+    while time.monotonic() < deadline and await db.jobs.find_one({"status": {"$in": ["pending", "running"]}}):
+        await asyncio.sleep(0.1)
+
+# Splits a recorded command into the queries it runs, as
+# (collection, filter, sort, explainable command); multi-statement updates
+# and deletes are explained one statement at a time
+def recorded_queries(command: dict):
+    command = {key: value for key, value in command.items() if key not in SESSION_FIELDS}
+    name = next(iter(command))
+    collection = command[name]
+    
+    if name == "aggregate":
+        pipeline = command.get("pipeline", [])
+        if pipeline and "$changeStream" in pipeline[0]:
+            return
+        match = pipeline[0].get("$match", {}) if pipeline else {}
+        # Only a $sort ahead of any grouping is served by an index
+        sort = None
+        for stage in pipeline:
+            if "$sort" in stage:
+                sort = stage["$sort"]
+            if "$sort" in stage or "$group" in stage:
+                break
+        yield collection, match, sort, command
+    elif name in ("update", "delete"):
+        key = "updates" if name == "update" else "deletes"
+        for statement in command.get(key, []):
+            yield collection, statement.get("q", {}), None, {name: collection, key: [statement]}
+    elif name == "find":
+        yield collection, command.get("filter", {}), command.get("sort"), command
+    else:
+        yield collection, command.get("query", {}), command.get("sort"), command
+
+# A filter with its values replaced by their types, so the same query run
+# with other values is explained once
+def value_shape(value):
+    if isinstance(value, dict):
+        return {key: value_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [value_shape(item) for item in value if isinstance(item, (dict, list))] or ["values"]
+    return type(value).__name__
+
+def filter_fields(value) -> List[str]:
+    fields = []
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if not key.startswith("$"):
+                fields.append(key)
+            fields.extend(filter_fields(item))
+    elif isinstance(value, list):
+        for item in value:
+            fields.extend(filter_fields(item))
+    return list(dict.fromkeys(fields))
+
+# The distinct query shapes among the recorded commands, named after the
+# command, the filtered fields and the sort
+def query_shapes(commands: List[dict]) -> List[dict]:
+    shapes = {}
+    for command in commands:
+        command_name = next(iter(command))
+        for collection, filter, sort, explainable in recorded_queries(command):
+            key = json.dumps([collection, command_name, value_shape(filter), value_shape(sort or {})])
+            if key in shapes:
+                continue
+            name = f"{collection}.{command_name}({','.join(filter_fields(filter))})"
+            if sort:
+                name += f" sort({','.join(sort)})"
+            whole = not filter and collection in WHOLE_COLLECTION_READS
+            shapes[key] = {"name": name, "collection": collection, "command": explainable,
+                           "full_scan": whole or collection in SMALL_COLLECTIONS}
+    return sorted(shapes.values(), key=lambda shape: shape["name"])
+
+def plan_stages(plan: dict) -> List[str]:
+    stages = [plan["stage"]] if "stage" in plan else []
+    for child in plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else []):
+        stages.extend(plan_stages(child))
+    return stages
+
+# Aggregations that are not pushed down whole nest the query explain under
+# their $cursor stage; slot-based plans (MongoDB 7+) nest the stage tree
+# under queryPlan
+def explain_sections(explain: dict) -> tuple:
+    if "queryPlanner" not in explain:
+        explain = next(stage["$cursor"] for stage in explain["stages"] if "$cursor" in stage)
+    plan = explain["queryPlanner"]["winningPlan"]
+    return plan.get("queryPlan", plan), explain.get("executionStats", {})
+
+async def explain_shape(db, query: dict) -> dict:
+    explain = await db.command({"explain": query["command"], "verbosity": "executionStats"})
+    plan, stats = explain_sections(explain)
+    
+    stages = plan_stages(plan)
+    collscan = "COLLSCAN" in stages
+    blocking_sort = "SORT" in stages
+    return {
+        "name": query["name"],
+        "collection": query["collection"],
+        "plan": " <- ".join(stages),
+        "keys_examined": stats.get("totalKeysExamined", 0),
+        "docs_examined": stats.get("totalDocsExamined", 0),
+        "returned": stats.get("nReturned", 0),
+        "collscan": collscan,
+        "blocking_sort": blocking_sort,
+        "ok": query["full_scan"] or not (collscan or blocking_sort),
+    }
+
+async def run_audit(database: str = AUDIT_DATABASE, documents: int = AUDIT_DOCUMENTS) -> List[dict]:
+    if database == server.db.name:
+        raise ValueError(f"Refusing to audit the application database {database!r}: it is dropped afterwards")
+    recorder = CommandRecorder(database)
+    audit_client = AsyncIOMotorClient(server.MONGO_URL, event_listeners=[recorder])
+    await audit_client.drop_database(database)
+    # The endpoints work on the module client and database
+    saved_client, saved_db = server.client, server.db
+    server.client, server.db = audit_client, audit_client[database]
+    try:
+        report = await server.ensure_indexes()
+        if report["failed"]:
+            raise RuntimeError(f"Index creation failed: {report['failed']}")
+        sample = await seed(server.db, documents)
+        # Built before recording so startup does not run the backfill
+        await server.rebuild_sales_rollups()
+        
+        recorder.recording = True
+        await server.startup_event()
+        tasks = list(server.background_tasks)
+        try:
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://audit") as http:
+                failures = await drive_endpoints(http, sample)
+            await drain_jobs(server.db)
+        finally:
+            recorder.recording = False
+            await server.shutdown_event()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if failures:
+            raise RuntimeError(f"Requests failed during the audit: {failures}")
+        
+        return [await explain_shape(server.db, query) for query in query_shapes(recorder.commands)]
+    finally:
+        server.client, server.db = saved_client, saved_db
+        await audit_client.drop_database(database)
+        audit_client.close()
+
+def print_report(results: List[dict]):
+    width = max(len(result["name"]) for result in results)
+    print(f"{'shape':<{width}}  {'keys':>6} {'docs':>6} {'ret':>6}  status    plan")
+    for result in results:
+        if not (result["collscan"] or result["blocking_sort"]):
+            status = "OK"
+        elif result["ok"]:
+            status = "FULL"
+        else:
+            status = "COLLSCAN" if result["collscan"] else "SORT"
+        print(f"{result['name']:<{width}}  {result['keys_examined']:>6} {result['docs_examined']:>6} "
+              f"{result['returned']:>6}  {status:<8}  {result['plan']}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Explain every query the endpoints issue and fail on "
+                                                 "collection scans and blocking sorts")
+    parser.add_argument("--database", default=AUDIT_DATABASE, help="scratch database, dropped before and after")
+    parser.add_argument("--documents", type=int, default=AUDIT_DOCUMENTS, help="documents seeded per collection")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+    
+    results = asyncio.run(run_audit(args.database, args.documents))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+    
+    failures = [result["name"] for result in results if not result["ok"]]
+    if failures:
+        print(f"\nCollection scans or blocking sorts on: {', '.join(failures)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset generator for Gestão Oficina Mecânica
+
+Fills a database with customers, parts, services and sales built from the
+server models, spread over a configurable number of days, then creates the
+indexes, default settings and daily rollups the server expects. The default
+volumes match the production scale we plan for; --scale shrinks them.
+
+    python seed_data.py [--database NAME] [--scale 0.01] [--days 365] [--drop]
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import server
+from server import Customer, Part, Sale, SaleItem, Service, customer_search_fields
+
+SEED_DATABASE = "oficina_mecanica_bench"
+SEED_BATCH_SIZE = 5000
+PRODUCTION_VOLUMES = {"customers": 200_000, "parts": 20_000, "services": 200, "sales": 2_000_000}
+
+FIRST_NAMES = ["Ana", "Bruno", "Carla", "Daniel", "Eduardo", "Fernanda", "Gabriel", "Helena", "Igor", "Júlia",
+               "Lucas", "Márcia", "Nicolas", "Otávio", "Patrícia", "Rafael", "Sérgio", "Tatiana", "Vinícius"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Ferreira", "Almeida", "Costa",
+              "Gomes", "Ribeiro", "Martins", "Araújo", "Barbosa", "Conceição"]
+PART_NAMES = ["Filtro de Óleo", "Filtro de Ar", "Pastilha de Freio", "Disco de Freio", "Vela de Ignição",
+              "Correia Dentada", "Amortecedor", "Bateria", "Lâmpada", "Radiador", "Embreagem", "Junta"]
+SERVICE_NAMES = ["Troca de Óleo", "Alinhamento", "Balanceamento", "Revisão", "Troca de Freios",
+                 "Diagnóstico", "Troca de Embreagem", "Higienização", "Suspensão", "Injeção Eletrônica"]
+# Relative sale volume per weekday, Monday first (the workshop closes on Sunday)
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.0, 1.2, 0.6, 0.0]
+
+def scaled_volumes(scale: float) -> Dict[str, int]:
+    return {name: max(1, int(count * scale)) for name, count in PRODUCTION_VOLUMES.items()}
+
+def make_customer(rng: random.Random, created_at: datetime) -> dict:
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+    phone = f"({rng.randint(11, 99)}) 9{rng.randint(1000, 9999)}-{rng.randint(0, 9999):04d}"
+    email = f"{name.split()[0].lower()}{rng.randint(1, 9999)}@example.com" if rng.random() < 0.6 else None
+    return Customer(name=name, phone=phone, email=email, created_at=created_at).model_dump()
+
+def make_part(rng: random.Random, number: int, created_at: datetime) -> dict:
+    cost_price = round(rng.uniform(5, 800), 2)
+    return Part(
+        name=f"{rng.choice(PART_NAMES)} {number}",
+        reference_code=f"REF-{number:06d}",
+        cost_price=cost_price,
+        sale_price=round(cost_price * rng.uniform(1.2, 1.8), 2),
+        stock_quantity=rng.choice([0, 1, 2, 3, 5]) if rng.random() < 0.05 else rng.randint(6, 500),
+        created_at=created_at
+    ).model_dump()
+
+def make_service(rng: random.Random, number: int, created_at: datetime) -> dict:
+    return Service(
+        name=f"{rng.choice(SERVICE_NAMES)} {number}",
+        price=round(rng.uniform(40, 1500), 2),
+        created_at=created_at
+    ).model_dump()
+
+def make_sale(rng: random.Random, sale_number: str, sale_date: datetime, customer: Optional[dict],
+              parts: List[dict], services: List[dict]) -> dict:
+    items = []
+    for _ in range(rng.choices([1, 2, 3, 4, 5], [35, 30, 20, 10, 5])[0]):
+        if rng.random() < 0.65:
+            part = rng.choice(parts)
+            quantity = rng.choices([1, 2, 4], [70, 20, 10])[0]
+            items.append(SaleItem(type="part", id=part["id"], name=part["name"], price=part["sale_price"],
+                                  quantity=quantity, subtotal=round(part["sale_price"] * quantity, 2)))
+        else:
+            service = rng.choice(services)
+            items.append(SaleItem(type="service", id=service["id"], name=service["name"],
+                                  price=service["price"], quantity=1, subtotal=service["price"]))
+    
+    subtotal_parts = round(sum(item.subtotal for item in items if item.type == "part"), 2)
+    subtotal_services = round(sum(item.subtotal for item in items if item.type == "service"), 2)
+    customer_data = None
+    if customer:
+        customer_data = {field: customer.get(field) for field in ("name", "phone", "email", "address")}
+    return Sale(
+        sale_number=sale_number,
+        date=sale_date,
+        customer_id=customer["id"] if customer else None,
+        customer_data=customer_data,
+        items=items,
+        subtotal_parts=subtotal_parts,
+        subtotal_services=subtotal_services,
+        total=round(subtotal_parts + subtotal_services, 2),
+        created_at=sale_date
+    ).model_dump()
+
+# Spreads the sales over the days, following the weekday weights
+def sales_per_day(rng: random.Random, first_day: datetime, days: int, sales: int) -> List[int]:
+    weights = [WEEKDAY_WEIGHTS[(first_day + timedelta(days=day)).weekday()] * rng.uniform(0.7, 1.3)
+               for day in range(days)]
+    total = sum(weights) or 1
+    counts = [int(sales * weight / total) for weight in weights]
+    busiest = max(range(days), key=lambda day: weights[day])
+    counts[busiest] += sales - sum(counts)
+    return counts
+
+async def insert_batches(collection, documents, batch_size: int) -> int:
+    inserted = 0
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            await collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+async def seed_database(database: str = SEED_DATABASE, volumes: Optional[Dict[str, int]] = None,
+                        days: int = 365, batch_size: int = SEED_BATCH_SIZE, drop: bool = False,
+                        seed: int = 42, log=print) -> dict:
+    if database == server.db.name and not drop:
+        raise ValueError(f"Seeding the application database {database!r} needs an explicit drop")
+    volumes = volumes or dict(PRODUCTION_VOLUMES)
+    rng = random.Random(seed)
+    if drop:
+        await server.client.drop_database(database)
+    db = server.client[database]
+    # The index, settings and rollup helpers work on the module database
+    server.db = db
+    
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = today - timedelta(days=days - 1)
+    # Catalog and customers exist before the first sale
+    history_start = first_day - timedelta(days=30)
+    
+    def created_at(index: int, count: int) -> datetime:
+        return history_start + (today - history_start) * (index / max(count, 1))
+    
+    started = time.perf_counter()
+    parts = [make_part(rng, number, created_at(number, volumes["parts"])) for number in range(volumes["parts"])]
+    services = [make_service(rng, number, history_start) for number in range(volumes["services"])]
+    await insert_batches(db.parts, parts, batch_size)
+    await insert_batches(db.services, services, batch_size)
+    log(f"parts: {len(parts)}, services: {len(services)}")
+    
+    customers = [make_customer(rng, created_at(number, volumes["customers"]))
+                 for number in range(volumes["customers"])]
+    await insert_batches(db.customers, (
+        {**customer, **customer_search_fields(customer)} for customer in customers
+    ), batch_size)
+    log(f"customers: {len(customers)}")
+    
+    def generate_sales():
+        for day, count in enumerate(sales_per_day(rng, first_day, days, volumes["sales"])):
+            day_start = first_day + timedelta(days=day, hours=8)
+            offsets = sorted(rng.uniform(0, 10 * 3600) for _ in range(count))
+            for number, offset in enumerate(offsets, start=1):
+                sale_date = day_start + timedelta(seconds=offset)
+                # Walk-in sales have no customer; the others pick one registered before the sale
+                customer = None
+                if rng.random() < 0.8:
+                    registered = int(len(customers) * (sale_date - history_start) / (today - history_start))
+                    customer = customers[rng.randrange(max(1, min(registered, len(customers))))]
+                yield make_sale(rng, f"{sale_date:%Y%m%d}{number:03d}", sale_date, customer, parts, services)
+    
+    sales = await insert_batches(db.sales, generate_sales(), batch_size)
+    log(f"sales: {sales}")
+    
+    report = await server.ensure_indexes()
+    if report["failed"]:
+        raise RuntimeError(f"Index creation failed: {report['failed']}")
+    await server.initialize_settings()
+    await server.rebuild_sales_rollups()
+    
+    info = {"_id": "seed", "volumes": volumes, "days": days, "seed": seed,
+            "first_day": first_day, "created_at": datetime.now()}
+    await db.seed_info.replace_one({"_id": "seed"}, info, upsert=True)
+    log(f"seeded {database} in {time.perf_counter() - started:.1f}s")
+    return info
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset at production scale")
+    parser.add_argument("--database", default=SEED_DATABASE, help="target database")
+    parser.add_argument("--scale", type=float, default=1.0, help="fraction of the production volumes")
+    for name, count in PRODUCTION_VOLUMES.items():
+        parser.add_argument(f"--{name}", type=int, help=f"number of {name} (default {count} x scale)")
+    parser.add_argument("--days", type=int, default=365, help="days of sales history ending today")
+    parser.add_argument("--batch-size", type=int, default=SEED_BATCH_SIZE, help="documents per insert_many")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument("--drop", action="store_true", help="drop the database first")
+    args = parser.parse_args(argv)
+    
+    volumes = scaled_volumes(args.scale)
+    for name in PRODUCTION_VOLUMES:
+        if getattr(args, name) is not None:
+            volumes[name] = getattr(args, name)
+    
+    asyncio.run(seed_database(args.database, volumes, args.days, args.batch_size, args.drop, args.seed))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,33 +1,330 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-from datetime import datetime, date
+from starlette.datastructures import MutableHeaders
+from starlette.routing import Match
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, create_model
+from typing import List, Optional, Dict, Any, Set, Tuple
+from datetime import datetime, date, timedelta
 import os
 import uuid
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import DuplicateKeyError
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateMany, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 import json
+import orjson
+import logging
+import asyncio
+import sys
+import time
+import threading
+import random
+import cProfile
+from contextvars import ContextVar
+from pathlib import Path
+import base64
+import codecs
+import csv
+import io
+import functools
+import hashlib
+import zlib
+from collections import OrderedDict, deque
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
 
 # Environment variables
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 
-app = FastAPI(title="Gestão Oficina Mecânica", version="1.0.0")
+# Pagination
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
-# CORS configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+# Sale numbers reserved per counter round trip. Values above 1 let each worker
+# hand out numbers from a local block; unused numbers are skipped on restart.
+SALE_NUMBER_BLOCK_SIZE = max(1, int(os.getenv("SALE_NUMBER_BLOCK_SIZE", "1")))
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+# Rows validated and written per round trip by the import endpoints, and the
+# number of row errors listed in an import report
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_ERRORS = 1000
+
+# Search endpoints return at most this many results
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Documents written by this server are returned as stored (projected to the
+# response model fields) without being validated again on every read
+TRUSTED_READS = os.getenv("TRUSTED_READS", "1").lower() in ("1", "true", "yes")
+
+# Responses smaller than this are sent uncompressed. Compressed bodies of the
+# catalog lists and settings are kept (up to COMPRESSION_CACHE_ENTRIES and
+# COMPRESSION_CACHE_BYTES in total) and served again without running the
+# endpoint while their ETag is current.
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_CACHE_ENTRIES = int(os.getenv("COMPRESSION_CACHE_ENTRIES", "256"))
+COMPRESSION_CACHE_BYTES = int(os.getenv("COMPRESSION_CACHE_BYTES", str(16 * 1024 * 1024)))
+COMPRESSION_CACHE_PATHS = ("/api/parts", "/api/services", "/api/settings")
+
+# How often each worker checks whether another worker changed cached data
+CACHE_POLL_SECONDS = float(os.getenv("CACHE_POLL_SECONDS", "2"))
+
+# Optional in-process cache of parts and services, reloaded at least every
+# CATALOG_CACHE_TTL seconds as a safety net
+CATALOG_CACHE_ENABLED = os.getenv("CATALOG_CACHE", "0").lower() in ("1", "true", "yes")
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+
+# "auto" uses multi-document transactions when MongoDB runs as a replica set
+MONGO_TRANSACTIONS = os.getenv("MONGO_TRANSACTIONS", "auto")
+
+# Change events served on /api/events. The last EVENTS_BUFFER_SIZE events are
+# kept for Last-Event-ID resume; a client more than EVENTS_QUEUE_SIZE events
+# behind is disconnected. "auto" feeds the events from a change stream when
+# MongoDB runs as a replica set.
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "1000"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))
+CHANGE_STREAMS = os.getenv("CHANGE_STREAMS", "auto")
+
+# Background jobs run by JOB_WORKERS in-process workers from the jobs
+# collection. A failed job is retried after JOB_BACKOFF_SECONDS, doubling per
+# attempt, up to JOB_MAX_ATTEMPTS; a job left running by a worker that died
+# is picked up again once its JOB_LOCK_SECONDS lock expires.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_SECONDS = float(os.getenv("JOB_BACKOFF_SECONDS", "2"))
+JOB_LOCK_SECONDS = float(os.getenv("JOB_LOCK_SECONDS", "60"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+JOB_QUEUE_SIZE = 1000
+
+# Idempotency-Key support for POST /api/sales. Stored results expire after
+# IDEMPOTENCY_KEY_TTL seconds. A duplicate that arrives while the first
+# request runs waits up to IDEMPOTENCY_WAIT_SECONDS for its result; a key
+# whose request died is taken over after IDEMPOTENCY_LOCK_SECONDS.
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 3600)))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "30"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_POLL_SECONDS = 0.1
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Slow-request log and sampled profiling. Requests slower than SLOW_REQUEST_MS
+# and Mongo commands slower than SLOW_QUERY_MS are written as JSON lines to
+# LOG_DIR. One request in PROFILE_SAMPLE_RATE (0 = never), or any request
+# sent with "X-Profile: 1" when PROFILE_HEADER is on, is run under cProfile
+# and its stats dumped to LOG_DIR/profiles.
+LOG_DIR = Path(os.getenv("LOG_DIR", str(Path(__file__).resolve().parent.parent / "deploy_local" / "logs")))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "0").lower() in ("1", "true", "yes")
+
+# Per-request counters shared with the Mongo listeners (Motor copies the
+# context into its driver threads, so they see the same dict)
+request_stats: ContextVar[Optional[dict]] = ContextVar("request_stats", default=None)
+slow_log_lock = threading.Lock()
+
+def write_slow_log(filename: str, entry: dict):
+    try:
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with slow_log_lock, open(LOG_DIR / filename, "a", encoding="utf-8") as log_file:
+            log_file.write(line + "\n")
+    except OSError as error:
+        logger.warning("Could not write %s: %s", filename, error)
+
+# orjson responses that account their render time to the current request
+class TimedORJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        started = time.perf_counter()
+        body = super().render(content)
+        stats = request_stats.get()
+        if stats is not None:
+            stats["serialize_time"] += time.perf_counter() - started
+        return body
+
+app = FastAPI(title="Gestão Oficina Mecânica", version="1.0.0", default_response_class=TimedORJSONResponse)
+
+# Metrics in Prometheus text format. Updated from the event loop and from the
+# PyMongo monitoring callbacks (driver threads), hence the lock.
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series: Dict[tuple, list] = {}
+        self.lock = threading.Lock()
+    
+    def observe(self, labels: tuple, value: float):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # [bucket counts..., sum, count]
+                series = self.series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            snapshot = {labels: list(series) for labels, series in self.series.items()}
+        for labels, series in sorted(snapshot.items()):
+            for bound, count in zip(self.buckets, series):
+                bucket_labels = format_labels(self.label_names, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            bucket_labels = format_labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple, kind: str = "counter"):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.kind = kind
+        self.values: Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+    
+    def set(self, labels: tuple, value: float):
+        with self.lock:
+            self.values[labels] = value
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            snapshot = dict(self.values)
+        for labels, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+HTTP_REQUEST_DURATION = Histogram(
+    "oficina_http_request_duration_seconds", "HTTP request latency by route template and status.",
+    ("method", "route", "status"), HTTP_BUCKETS
+)
+HTTP_IN_FLIGHT = Counter("oficina_http_requests_in_flight", "HTTP requests being served.", (), kind="gauge")
+MONGO_COMMAND_DURATION = Histogram(
+    "oficina_mongo_command_duration_seconds", "MongoDB command latency by collection and command.",
+    ("collection", "command"), MONGO_BUCKETS
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "oficina_mongo_command_failures_total", "MongoDB commands that failed.", ("collection", "command")
 )
+MONGO_CHECKOUT_WAIT = Histogram(
+    "oficina_mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", (), MONGO_BUCKETS
+)
+MONGO_CHECKOUT_FAILURES = Counter(
+    "oficina_mongo_pool_checkout_failures_total", "Connection pool checkouts that failed.", ("reason",)
+)
+JOB_DURATION = Histogram(
+    "oficina_job_duration_seconds", "Background job run time by type and outcome.", ("type", "outcome"), HTTP_BUCKETS
+)
+JOB_RUNS = Counter("oficina_job_runs_total", "Background job runs by type and outcome.", ("type", "outcome"))
+
+def command_collection(command_name: str, command: dict) -> str:
+    target = command.get(command_name)
+    if command_name == "getMore":
+        return command.get("collection", "")
+    return target if isinstance(target, str) else ""
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self.collections: Dict[tuple, str] = {}
+        self.lock = threading.Lock()
+    
+    def started(self, event):
+        with self.lock:
+            self.collections[(event.connection_id, event.request_id)] = command_collection(event.command_name, event.command)
+    
+    def _finished(self, event) -> tuple:
+        seconds = event.duration_micros / 1e6
+        stats = request_stats.get()
+        with self.lock:
+            collection = self.collections.pop((event.connection_id, event.request_id), "")
+            if stats is not None:
+                stats["db_calls"] += 1
+                stats["db_time"] += seconds
+        
+        labels = (collection, event.command_name)
+        MONGO_COMMAND_DURATION.observe(labels, seconds)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            write_slow_log("slow_queries.log", {
+                "ts": datetime.now().isoformat(),
+                "collection": collection,
+                "command": event.command_name,
+                "duration_ms": round(seconds * 1000, 2),
+                "path": stats["path"] if stats else None,
+            })
+        return labels
+    
+    def succeeded(self, event):
+        self._finished(event)
+    
+    def failed(self, event):
+        MONGO_COMMAND_FAILURES.inc(self._finished(event))
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.checkout_started = threading.local()
+    
+    def connection_check_out_started(self, event):
+        self.checkout_started.value = time.perf_counter()
+    
+    def connection_checked_out(self, event):
+        started = getattr(self.checkout_started, "value", None)
+        if started is not None:
+            MONGO_CHECKOUT_WAIT.observe((), time.perf_counter() - started)
+    
+    def connection_check_out_failed(self, event):
+        self.connection_checked_out(event)
+        MONGO_CHECKOUT_FAILURES.inc((event.reason,))
+    
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_checked_in(self, event): pass
 
 # MongoDB client
-client = AsyncIOMotorClient(MONGO_URL)
+client = AsyncIOMotorClient(MONGO_URL, event_listeners=[CommandMetrics(), PoolMetrics()])
 db = client.oficina_mecanica
 
+# Set at startup when the server supports multi-document transactions
+transactions_enabled = False
+
 # Pydantic models
 class Customer(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -75,6 +372,23 @@ class PartUpdate(BaseModel):
     sale_price: Optional[float] = None
     stock_quantity: Optional[int] = None
 
+class PartAdjustment(BaseModel):
+    id: str
+    cost_price: Optional[float] = None
+    sale_price: Optional[float] = None
+    stock_quantity: Optional[int] = None
+    stock_delta: Optional[int] = None
+
+class PartPriceChange(BaseModel):
+    percent: float
+    fields: List[str] = ["sale_price"]
+    ids: Optional[List[str]] = None
+    reference_code_prefix: Optional[str] = None
+
+class PartBatchUpdate(BaseModel):
+    updates: List[PartAdjustment] = []
+    price_change: Optional[PartPriceChange] = None
+
 class Service(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -125,23 +439,1339 @@ class Setting(BaseModel):
 class SettingUpdate(BaseModel):
     value: Any
 
+# Mongo projections returning exactly the fields of a response model
+def model_projection(model) -> dict:
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+CUSTOMER_PROJECTION = model_projection(Customer)
+PART_PROJECTION = model_projection(Part)
+SERVICE_PROJECTION = model_projection(Service)
+SALE_PROJECTION = model_projection(Sale)
+SETTING_PROJECTION = model_projection(Setting)
+
+# Sparse fieldsets: ?fields=id,name,sale_price narrows the projection to
+# those fields, with a matching response model built on first use
+@functools.lru_cache(maxsize=256)
+def sparse_model(model, names: tuple):
+    return create_model(
+        f"{model.__name__}Fields",
+        **{name: (model.model_fields[name].annotation, model.model_fields[name]) for name in names}
+    )
+
+# Returns (projection, response model) for a `fields` query parameter; the
+# model is None when every field of `model` is returned
+def select_fields(model, fields: Optional[str]):
+    if not fields:
+        return model_projection(model), None
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in model.model_fields]
+    if not names or unknown:
+        raise HTTPException(status_code=400, detail=f"Invalid fields: {', '.join(unknown) or fields}")
+    return {"_id": 0, **{name: 1 for name in names}}, sparse_model(model, names)
+
+def project_documents(documents: List[dict], projection: dict) -> List[dict]:
+    return [{key: value for key, value in document.items() if key in projection} for document in documents]
+
+# Fast path for reads: serialize the projected documents with orjson and skip
+# the response_model validation. With TRUSTED_READS off the documents go
+# through response_model (or the sparse `model`) as before. Headers set on
+# `response` (pagination cursor) are carried over.
+def trusted_response(content, response: Optional[Response] = None, model=None):
+    if not TRUSTED_READS:
+        if model is None:
+            return content
+        if isinstance(content, list):
+            content = [model.model_validate(document).model_dump(mode="json") for document in content]
+        else:
+            content = model.model_validate(content).model_dump(mode="json")
+    headers = {key: value for key, value in response.headers.items() if key != "content-length"} if response else None
+    return TimedORJSONResponse(content, headers=headers)
+
 # Utility functions
+# Sale numbers are "YYYYMMDD" followed by a per-day sequence of at least three
+# digits, allocated from the counters collection with one atomic $inc.
+def sale_counter_id(day: str) -> str:
+    return f"sale_number:{day}"
+
+# The first allocation of a day starts the counter after any sale already
+# numbered that day (sales created before counters or written by the seeder).
+# Suffixes grow past three digits, so the maximum is taken numerically (a
+# string sort puts "...999" after "...1000") over the day's keys in the
+# sale_number index.
+async def seed_sale_counter(day: str):
+    suffixes = [sale["sale_number"][len(day):] async for sale in db.sales.find(
+        {"sale_number": prefix_query(day)}, {"_id": 0, "sale_number": 1}
+    )]
+    last_number = max((int(suffix) for suffix in suffixes if suffix.isdigit()), default=0)
+    try:
+        await db.counters.update_one(
+            {"_id": sale_counter_id(day)},
+            {"$max": {"seq": last_number}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Another worker created the counter concurrently
+        pass
+
+# Reserves `count` consecutive numbers for `day` and returns the last one
+async def reserve_sale_numbers(day: str, count: int = 1) -> int:
+    counter = await db.counters.find_one_and_update(
+        {"_id": sale_counter_id(day)},
+        {"$inc": {"seq": count}},
+        return_document=ReturnDocument.AFTER
+    )
+    if counter is None:
+        await seed_sale_counter(day)
+        counter = await db.counters.find_one_and_update(
+            {"_id": sale_counter_id(day)},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    return counter["seq"]
+
+# Local block of reserved numbers: day -> [next, last]
+sale_number_block: Dict[str, List[int]] = {}
+sale_number_lock = asyncio.Lock()
+
 async def generate_sale_number():
     today = datetime.now().strftime("%Y%m%d")
     
-    # Find the last sale number for today
-    last_sale = await db.sales.find_one(
-        {"sale_number": {"$regex": f"^{today}"}}, 
-        sort=[("sale_number", -1)]
+    if SALE_NUMBER_BLOCK_SIZE == 1:
+        new_number = await reserve_sale_numbers(today)
+    else:
+        async with sale_number_lock:
+            block = sale_number_block.get(today)
+            if not block or block[0] > block[1]:
+                last = await reserve_sale_numbers(today, SALE_NUMBER_BLOCK_SIZE)
+                sale_number_block.clear()
+                block = sale_number_block[today] = [last - SALE_NUMBER_BLOCK_SIZE + 1, last]
+            new_number = block[0]
+            block[0] += 1
+    
+    return f"{today}{new_number:03d}"
+
+def encode_cursor(document: dict, sort_field: str) -> str:
+    value = document[sort_field]
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    payload = json.dumps([value, document["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["$date"])
+        return value, str(last_id)
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Keyset pagination over (sort_field, id). Returns at most `limit` documents and
+# sets the opaque cursor for the next page in the X-Next-Cursor response header
+# (the header is absent on the last page).
+async def paginate(collection, response: Response, limit: int, cursor: Optional[str] = None,
+                   query: Optional[dict] = None, sort_field: str = "created_at", descending: bool = False,
+                   projection: Optional[dict] = None):
+    filters = [query] if query else []
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        op = "$lt" if descending else "$gt"
+        filters.append({"$or": [
+            {sort_field: {op: value}},
+            {sort_field: value, "id": {op: last_id}},
+        ]})
+    
+    if not filters:
+        mongo_query = {}
+    elif len(filters) == 1:
+        mongo_query = filters[0]
+    else:
+        mongo_query = {"$and": filters}
+    
+    # The cursor needs the sort keys even when the caller did not ask for them
+    hidden = []
+    if projection is not None:
+        hidden = [field for field in dict.fromkeys((sort_field, "id")) if field not in projection]
+        projection = {**projection, **{field: 1 for field in hidden}}
+    
+    direction = -1 if descending else 1
+    documents = await collection.find(mongo_query, projection).sort(
+        [(sort_field, direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    if len(documents) > limit:
+        documents = documents[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(documents[-1], sort_field)
+    for document in documents:
+        for field in hidden:
+            document.pop(field, None)
+    return documents
+
+# Indexes required by the queries this server issues, per collection.
+# Lookups by id, sale_number and settings key are unique seeks; created_at and
+# the sales date are paired with id to match the keyset pagination sort (and
+# the export order), so ranges are returned in index order without a SORT.
+# Both branches of the due-job query scan status_run_at_locked_until in
+# run_at order, so claiming the oldest due job merges them without a SORT.
+REQUIRED_INDEXES = {
+    "customers": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("phone_normalized", ASCENDING)], name="phone_normalized"),
+        IndexModel([("name_folded", ASCENDING)], name="name_folded"),
+    ],
+    "parts": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("stock_quantity", ASCENDING)], name="stock_quantity"),
+        IndexModel([("reference_code", ASCENDING)], name="reference_code"),
+    ],
+    "services": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+    ],
+    "sales": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("sale_number", ASCENDING)], name="sale_number_unique", unique=True),
+        IndexModel([("date", ASCENDING), ("id", ASCENDING)], name="date_id"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    ],
+    "settings": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("key", ASCENDING)], name="key_unique", unique=True),
+    ],
+    "jobs": [
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING), ("locked_until", ASCENDING)],
+                   name="status_run_at_locked_until"),
+    ],
+    "idempotency_keys": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=IDEMPOTENCY_KEY_TTL),
+    ],
+}
+
+# Index options compared against the live index to detect drift
+INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+def index_drift(expected: dict, existing: dict) -> List[str]:
+    problems = []
+    if list(expected["key"].items()) != list(existing["key"]):
+        problems.append(f"key {list(existing['key'])} != {list(expected['key'].items())}")
+    for option in INDEX_OPTIONS:
+        if expected.get(option) != existing.get(option):
+            problems.append(f"{option} {existing.get(option)!r} != {expected.get(option)!r}")
+    return problems
+
+# Creates missing indexes and reports drift (indexes with the same name but a
+# different definition, and indexes nobody declared). Safe to run on every
+# startup: existing indexes are left untouched.
+async def ensure_indexes():
+    report = {"created": [], "drift": [], "unexpected": [], "failed": []}
+    
+    for collection_name, models in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        
+        for model in models:
+            expected = model.document
+            name = expected["name"]
+            qualified = f"{collection_name}.{name}"
+            
+            if name in existing:
+                problems = index_drift(expected, existing[name])
+                if problems:
+                    report["drift"].append(qualified)
+                    logger.warning("Index %s drifted: %s", qualified, "; ".join(problems))
+                continue
+            
+            try:
+                await collection.create_indexes([model])
+                report["created"].append(qualified)
+                logger.info("Created index %s", qualified)
+            except OperationFailure as error:
+                report["failed"].append(qualified)
+                logger.error("Could not create index %s: %s", qualified, error)
+        
+        declared = {model.document["name"] for model in models} | {"_id_"}
+        for name in existing:
+            if name not in declared:
+                report["unexpected"].append(f"{collection_name}.{name}")
+                logger.warning("Index %s.%s is not declared in REQUIRED_INDEXES", collection_name, name)
+    
+    return report
+
+# Daily sales rollups: one sales_daily document per day ("YYYY-MM-DD") with
+# the sale count, revenue split, units sold per part and per service and the
+# ids of the sales it holds (applied). The rollup_sale job queued by
+# create_sale keeps it current with $inc; rebuild_sales_rollups backfills it.
+def rollup_day(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d")
+
+# The applied filter and $addToSet make the increment and its guard a single
+# atomic write, so a retried or repeated job never counts a sale twice.
+# Returns False when the day already held the sale.
+async def apply_sale_to_rollup(sale: Sale) -> bool:
+    increments = {
+        "count": 1,
+        "revenue": sale.total,
+        "parts_revenue": sale.subtotal_parts,
+        "services_revenue": sale.subtotal_services,
+    }
+    for item in sale.items:
+        group = "parts" if item.type == "part" else "services"
+        key = f"{group}.{item.id}"
+        increments[key] = increments.get(key, 0) + item.quantity
+    
+    try:
+        await db.sales_daily.update_one(
+            {"_id": rollup_day(sale.date), "applied": {"$ne": sale.id}},
+            {
+                "$inc": increments,
+                "$addToSet": {"applied": sale.id},
+                "$setOnInsert": {"date": datetime.strptime(rollup_day(sale.date), "%Y-%m-%d")}
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The filter missed because the day exists and holds the sale
+        return False
+    return True
+
+# Sales created within this window before a rebuild starts may still be in
+# flight; the rebuild leaves them to apply_sale_to_rollup
+ROLLUP_REBUILD_OVERLAP = timedelta(minutes=5)
+ROLLUP_REBUILD_LOCK_SECONDS = 600
+
+# Rebuilds into a staging collection renamed over sales_daily, so readers and
+# running jobs never see it empty or half written. The aggregations stop at a
+# cutoff; sales from the cutoff on (including any a job applied to the old
+# collection meanwhile) are applied afterwards, and applied keeps them from
+# counting twice.
+async def rebuild_sales_rollups():
+    day_expression = {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}}
+    cutoff = datetime.now() - ROLLUP_REBUILD_OVERLAP
+    before_cutoff = {"$match": {"created_at": {"$lt": cutoff}}}
+    rollups = {}
+    async for row in db.sales.aggregate([
+        before_cutoff,
+        {"$group": {
+            "_id": day_expression,
+            "count": {"$sum": 1},
+            "revenue": {"$sum": "$total"},
+            "parts_revenue": {"$sum": "$subtotal_parts"},
+            "services_revenue": {"$sum": "$subtotal_services"},
+            "applied": {"$push": "$id"},
+        }},
+    ], allowDiskUse=True):
+        day = row.pop("_id")
+        rollups[day] = {"_id": day, "date": datetime.strptime(day, "%Y-%m-%d"),
+                        "parts": {}, "services": {}, **row}
+    
+    async for row in db.sales.aggregate([
+        before_cutoff,
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {"day": day_expression, "type": "$items.type", "id": "$items.id"},
+            "units": {"$sum": "$items.quantity"},
+        }},
+    ], allowDiskUse=True):
+        group = "parts" if row["_id"]["type"] == "part" else "services"
+        rollups[row["_id"]["day"]][group][row["_id"]["id"]] = row["units"]
+    
+    if rollups:
+        staging = db[f"sales_daily_rebuild_{uuid.uuid4().hex[:8]}"]
+        await staging.insert_many(list(rollups.values()))
+        await staging.rename("sales_daily", dropTarget=True)
+    else:
+        await db.sales_daily.drop()
+    
+    async for sale in db.sales.find({"created_at": {"$gte": cutoff}}, SALE_PROJECTION):
+        await apply_sale_to_rollup(Sale(**sale))
+    await bump_version("sales")
+    logger.info("Rebuilt %d daily sales rollups", len(rollups))
+    return len(rollups)
+
+# Cross-worker locks: a counters document ("lock:<name>") held until
+# locked_until. Taking a held lock misses the filter and the upsert then
+# collides on _id.
+async def acquire_lock(name: str, seconds: float) -> bool:
+    now = datetime.now()
+    try:
+        await db.counters.update_one(
+            {"_id": f"lock:{name}", "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+async def release_lock(name: str):
+    await db.counters.delete_one({"_id": f"lock:{name}"})
+
+# Sums the daily rollups between two "YYYY-MM-DD" days (inclusive)
+async def sum_sales_rollups(start_day: Optional[str] = None, end_day: Optional[str] = None):
+    day_range = {}
+    if start_day:
+        day_range["$gte"] = start_day
+    if end_day:
+        day_range["$lte"] = end_day
+    
+    totals = await db.sales_daily.aggregate([
+        {"$match": {"_id": day_range} if day_range else {}},
+        {"$group": {
+            "_id": None,
+            "total_sales": {"$sum": "$count"},
+            "total_revenue": {"$sum": "$revenue"},
+            "parts_revenue": {"$sum": "$parts_revenue"},
+            "services_revenue": {"$sum": "$services_revenue"},
+        }},
+    ]).to_list(1)
+    totals = totals[0] if totals else {}
+    return {
+        "total_sales": totals.get("total_sales", 0),
+        "total_revenue": totals.get("total_revenue", 0),
+        "parts_revenue": totals.get("parts_revenue", 0),
+        "services_revenue": totals.get("services_revenue", 0),
+    }
+
+async def is_replica_set() -> bool:
+    try:
+        hello = await client.admin.command("hello")
+    except PyMongoError:
+        return False
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+async def detect_transaction_support() -> bool:
+    if MONGO_TRANSACTIONS == "off":
+        return False
+    return await is_replica_set()
+
+# Stock decrement for sales. Quantities are merged per part and every part is
+# decremented with a conditional filter (stock_quantity >= quantity) in one
+# bulk_write, so stock can never go negative.
+class InsufficientStock(Exception):
+    def __init__(self, items: List[dict]):
+        super().__init__("Insufficient stock")
+        self.items = items
+
+def requested_part_quantities(items: List[SaleItem]) -> Dict[str, int]:
+    quantities = {}
+    for item in items:
+        if item.type == "part":
+            quantities[item.id] = quantities.get(item.id, 0) + item.quantity
+    return quantities
+
+# Lists the parts that cannot cover the requested quantities right now
+async def find_stock_shortages(quantities: Dict[str, int], session=None) -> List[dict]:
+    parts = await db.parts.find(
+        {"id": {"$in": list(quantities)}},
+        {"_id": 0, "id": 1, "name": 1, "stock_quantity": 1},
+        session=session
+    ).to_list(len(quantities))
+    found = {part["id"]: part for part in parts}
+    
+    shortages = []
+    for part_id, quantity in quantities.items():
+        part = found.get(part_id)
+        available = part["stock_quantity"] if part else None
+        if available is None or available < quantity:
+            shortages.append({
+                "id": part_id,
+                "name": part["name"] if part else None,
+                "requested": quantity,
+                "available": available,
+                "reason": "not_found" if part is None else "insufficient_stock",
+            })
+    return shortages
+
+# Parts decremented outside a transaction hold the sale id in stock_holds
+# until the sale is inserted, so a partially applied bulk can be told apart
+# and rolled back, by the request or, after a crash, by its
+# release_stock_holds job. Only sales in flight hold a part.
+def stock_decrement_ops(quantities: Dict[str, int], sale_id: Optional[str] = None) -> List[UpdateOne]:
+    ops = []
+    for part_id, quantity in quantities.items():
+        update = {"$inc": {"stock_quantity": -quantity}}
+        if sale_id:
+            update["$push"] = {"stock_holds": sale_id}
+        ops.append(UpdateOne({"id": part_id, "stock_quantity": {"$gte": quantity}}, update))
+    return ops
+
+# Returns how many parts gave their held stock back
+async def release_stock_holds(quantities: Dict[str, int], sale_id: str) -> int:
+    result = await db.parts.bulk_write([
+        UpdateOne(
+            {"id": part_id, "stock_holds": sale_id},
+            {"$inc": {"stock_quantity": quantity}, "$pull": {"stock_holds": sale_id}}
+        )
+        for part_id, quantity in quantities.items()
+    ], ordered=False)
+    return result.modified_count
+
+# Decrements stock and inserts the sale and its jobs. With transactions all
+# writes commit together. Without them the jobs are stored first, held back
+# for JOB_LOCK_SECONDS, and released once the sale is in: a crash after the
+# sale insert still leaves its jobs to run after the hold, and a failed
+# decrement or insert is compensated and the jobs deleted. A
+# release_stock_holds job stored with them covers a crash before the sale
+# insert: it gives back the stock the sale still holds if the sale is missing.
+async def commit_sale(sale_data: Sale, quantities: Dict[str, int], jobs: List[dict]):
+    if transactions_enabled:
+        async def write_sale(session):
+            if quantities:
+                result = await db.parts.bulk_write(
+                    stock_decrement_ops(quantities), ordered=False, session=session
+                )
+                if result.matched_count < len(quantities):
+                    raise InsufficientStock([])
+            await db.sales.insert_one(sale_data.model_dump(), session=session)
+            await db.jobs.insert_many(jobs, session=session)
+        
+        try:
+            async with await client.start_session() as session:
+                await session.with_transaction(write_sale)
+        except InsufficientStock:
+            raise InsufficientStock(await find_stock_shortages(quantities))
+        return
+    
+    release_jobs = []
+    if quantities:
+        release_jobs.append(new_job("release_stock_holds", {"sale_id": sale_data.id, "quantities": quantities}))
+    job_ids = [job["_id"] for job in jobs]
+    release_ids = [job["_id"] for job in release_jobs]
+    held_until = datetime.now() + timedelta(seconds=JOB_LOCK_SECONDS)
+    await db.jobs.insert_many([{**job, "run_at": held_until} for job in jobs + release_jobs])
+    try:
+        if quantities:
+            result = await db.parts.bulk_write(
+                stock_decrement_ops(quantities, sale_data.id), ordered=False
+            )
+            if result.matched_count < len(quantities):
+                held = await db.parts.find(
+                    {"id": {"$in": list(quantities)}, "stock_holds": sale_data.id},
+                    {"_id": 0, "id": 1}
+                ).to_list(len(quantities))
+                held_ids = {part["id"] for part in held}
+                await release_stock_holds(quantities, sale_data.id)
+                raise InsufficientStock(await find_stock_shortages(
+                    {part_id: quantity for part_id, quantity in quantities.items() if part_id not in held_ids}
+                ))
+        
+        try:
+            await db.sales.insert_one(sale_data.model_dump())
+        except Exception:
+            if quantities:
+                await release_stock_holds(quantities, sale_data.id)
+            raise
+        if quantities:
+            try:
+                await db.parts.update_many(
+                    {"id": {"$in": list(quantities)}, "stock_holds": sale_data.id},
+                    {"$pull": {"stock_holds": sale_data.id}}
+                )
+            except PyMongoError as error:
+                # A leftover hold only costs space; the sale is recorded
+                logger.warning("Could not clear the stock holds of sale %s: %s", sale_data.id, error)
+    except Exception:
+        try:
+            # The release job stays and runs now, for any hold the
+            # compensation above could not give back
+            await db.jobs.delete_many({"_id": {"$in": job_ids}})
+            if release_ids:
+                await db.jobs.update_many({"_id": {"$in": release_ids}}, {"$set": {"run_at": datetime.now()}})
+                schedule_jobs(release_jobs)
+        except PyMongoError as error:
+            # Jobs left behind find no sale and finish without doing anything
+            logger.warning("Could not delete the jobs of failed sale %s: %s", sale_data.id, error)
+        raise
+    
+    try:
+        await db.jobs.update_many({"_id": {"$in": job_ids + release_ids}}, {"$set": {"run_at": datetime.now()}})
+    except PyMongoError as error:
+        logger.warning("Could not release the jobs of sale %s, they run after the hold: %s", sale_data.id, error)
+        return
+    # The caller queues the sale's own jobs
+    schedule_jobs(release_jobs)
+
+# Same contract as paginate() for documents already held in memory
+def paginate_documents(documents: List[dict], response: Response, limit: int, cursor: Optional[str] = None,
+                       sort_field: str = "created_at", descending: bool = False):
+    ordered = sorted(documents, key=lambda document: (document[sort_field], document["id"]), reverse=descending)
+    if cursor:
+        position = decode_cursor(cursor)
+        if descending:
+            ordered = [document for document in ordered if (document[sort_field], document["id"]) < position]
+        else:
+            ordered = [document for document in ordered if (document[sort_field], document["id"]) > position]
+    
+    if len(ordered) > limit:
+        ordered = ordered[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(ordered[-1], sort_field)
+    return ordered
+
+# Data versions: a counters document per cached collection ("version:<name>")
+# bumped on every write, so each worker can tell when its copy is stale.
+def version_id(name: str) -> str:
+    return f"version:{name}"
+
+async def bump_version(name: str) -> int:
+    counter = await db.counters.find_one_and_update(
+        {"_id": version_id(name)},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
     )
+    return counter["seq"]
+
+async def read_versions(names: List[str]) -> Dict[str, int]:
+    counters = await db.counters.find({"_id": {"$in": [version_id(name) for name in names]}}).to_list(len(names))
+    versions = {name: 0 for name in names}
+    for counter in counters:
+        versions[counter["_id"][len("version:"):]] = counter["seq"]
+    return versions
+
+# Conditional GET: read endpoints are tagged with a strong ETag built from the
+# versions of the collections they depend on plus the path and query string,
+# so an unchanged resource is answered with 304 from the version counters
+# alone (from memory for resources served by a fresh cache). The longest matching path prefix wins.
+ETAG_COLLECTIONS = {
+    "/api/customers": ["customers"],
+    "/api/parts": ["parts"],
+    "/api/parts/low-stock": ["parts", "settings", "low_stock"],
+    "/api/services": ["services"],
+    "/api/sales": ["sales"],
+    "/api/settings": ["settings"],
+    "/api/reports/sales": ["sales"],
+    "/api/reports/summary": ["sales"],
+}
+
+def etag_collections(path: str) -> Optional[List[str]]:
+    matches = [prefix for prefix in ETAG_COLLECTIONS if path == prefix or path.startswith(prefix + "/")]
+    return ETAG_COLLECTIONS[max(matches, key=len)] if matches else None
+
+# Versions held in memory by this worker's fresh caches. Resources served
+# from those caches are tagged with the version of the copy they come from,
+# so a hot read needs no counters query.
+def cached_versions(names: List[str]) -> Dict[str, int]:
+    versions = {}
+    if "settings" in names and settings_cache_version is not None:
+        versions["settings"] = settings_cache_version
+    for name in names:
+        cache = catalog_caches.get(name)
+        if cache is not None and CATALOG_CACHE_ENABLED and cache.is_fresh():
+            versions[name] = cache.version
+    return versions
+
+async def compute_etag(request: Request, names: List[str]) -> str:
+    versions = cached_versions(names)
+    missing = [name for name in names if name not in versions]
+    if missing:
+        versions.update(await read_versions(missing))
+    resource = hashlib.sha1(f"{request.url.path}?{request.url.query}".encode()).hexdigest()[:16]
+    return '"' + resource + "-" + ".".join(str(versions[name]) for name in names) + '"'
+
+# "*" is not honored: the 304 is decided before the handler runs, so it
+# would answer for resources that do not exist or requests that would fail
+# validation. Those fall through to the handler.
+def etag_matches(if_none_match: Optional[str], etag: str) -> Optional[str]:
+    if not if_none_match:
+        return None
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return next((candidate for candidate in candidates if candidate == etag), None)
+
+# Each content-coding of a resource is a different representation, so it gets
+# its own strong tag: the identity tag with the coding appended
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    if not encoding or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+# Settings cache: every setting document held in memory, loaded at startup,
+# refreshed by update_setting and reloaded when another worker bumps the
+# settings version.
+settings_cache: Dict[str, dict] = {}
+settings_cache_version: Optional[int] = None
+
+async def load_settings_cache():
+    global settings_cache, settings_cache_version
+    version = (await read_versions(["settings"]))["settings"]
+    settings = await db.settings.find({}, SETTING_PROJECTION).to_list(None)
+    settings_cache = {setting["key"]: setting for setting in settings}
+    settings_cache_version = version
+
+def get_setting_value(key: str, default: Any = None) -> Any:
+    setting = settings_cache.get(key)
+    return setting["value"] if setting else default
+
+# Catalog cache: parts or services keyed by id. Reads are served from memory
+# while the copy is fresh; writes go through to it and bump the version so
+# other workers drop their copy.
+class CatalogCache:
+    def __init__(self, name: str, projection: dict):
+        self.name = name
+        self.projection = projection
+        self.documents: Dict[str, dict] = {}
+        self.version: Optional[int] = None
+        self.loaded_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.lock = asyncio.Lock()
+    
+    def is_fresh(self) -> bool:
+        return self.version is not None and time.monotonic() - self.loaded_at < CATALOG_CACHE_TTL
+    
+    async def load(self):
+        version = (await read_versions([self.name]))[self.name]
+        documents = await db[self.name].find({}, self.projection).to_list(None)
+        self.documents = {document["id"]: document for document in documents}
+        self.version = version
+        self.loaded_at = time.monotonic()
+    
+    # True when reads can be served from memory, loading the copy if needed
+    async def ready(self) -> bool:
+        if not CATALOG_CACHE_ENABLED:
+            return False
+        if self.is_fresh():
+            self.hits += 1
+            return True
+        self.misses += 1
+        async with self.lock:
+            if not self.is_fresh():
+                await self.load()
+        return True
+    
+    def invalidate(self):
+        self.version = None
+        self.documents = {}
+    
+    def put(self, document: dict):
+        if self.version is not None:
+            self.documents[document["id"]] = {k: v for k, v in document.items() if k in self.projection}
+    
+    def remove(self, document_id: str):
+        self.documents.pop(document_id, None)
+    
+    def adjust_stock(self, quantities: Dict[str, int]):
+        for part_id, quantity in quantities.items():
+            document = self.documents.get(part_id)
+            if document:
+                document["stock_quantity"] -= quantity
+    
+    # Called with the version produced by this worker's own write: the copy
+    # stays valid only if no other write happened in between
+    def written(self, version: int):
+        if self.version is not None and version == self.version + 1:
+            self.version = version
+        else:
+            self.invalidate()
     
-    if last_sale:
-        last_number = int(last_sale["sale_number"][-3:])
-        new_number = last_number + 1
+    def stats(self) -> dict:
+        return {"enabled": CATALOG_CACHE_ENABLED, "size": len(self.documents), "version": self.version,
+                "hits": self.hits, "misses": self.misses}
+
+catalog_caches = {"parts": CatalogCache("parts", PART_PROJECTION), "services": CatalogCache("services", SERVICE_PROJECTION)}
+
+async def catalog_written(name: str):
+    version = await bump_version(name)
+    catalog_caches[name].written(version)
+
+# Background refresh of the in-process caches
+async def cache_refresh_loop():
+    while True:
+        await asyncio.sleep(CACHE_POLL_SECONDS)
+        try:
+            versions = await read_versions(["settings", *catalog_caches])
+            if versions["settings"] != settings_cache_version:
+                await load_settings_cache()
+            for name, cache in catalog_caches.items():
+                if cache.version is not None and versions[name] != cache.version:
+                    cache.invalidate()
+        except PyMongoError as error:
+            logger.warning("Cache refresh failed: %s", error)
+
+background_tasks: List[asyncio.Task] = []
+
+# Change events. Write endpoints publish small events to this worker's
+# broker; when a change stream feeds the broker instead (external), the
+# endpoints stay quiet and every worker sees every write. Event ids carry a
+# per-process stream id, so a Last-Event-ID from another process or from
+# before a restart gets a "reset" event telling the client to refetch.
+class EventSubscriber:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+        self.lagged = False
+
+class EventBroker:
+    def __init__(self, buffer_size: int):
+        self.stream = uuid.uuid4().hex[:8]
+        self.sequence = 0
+        self.buffer: deque = deque(maxlen=buffer_size)
+        self.subscribers: Set[EventSubscriber] = set()
+        self.external = False
+        self.published = 0
+        self.lagged = 0
+    
+    def last_id(self) -> str:
+        return f"{self.stream}-{self.sequence}"
+    
+    def publish(self, event_type: str, data: dict):
+        self.sequence += 1
+        self.published += 1
+        event = {"id": self.last_id(), "type": event_type, "data": data}
+        self.buffer.append((self.sequence, event))
+        for subscriber in self.subscribers:
+            if subscriber.lagged:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Stops receiving; the stream ends after the queued events
+                subscriber.lagged = True
+                self.lagged += 1
+    
+    # Returns the subscriber, the buffered events after last_event_id and
+    # whether the client must refetch because that position is gone
+    def subscribe(self, last_event_id: Optional[str]) -> Tuple[EventSubscriber, List[dict], bool]:
+        backlog, reset = [], False
+        if last_event_id:
+            stream, _, sequence = last_event_id.partition("-")
+            oldest = self.buffer[0][0] if self.buffer else self.sequence + 1
+            if stream != self.stream or not sequence.isdigit() or int(sequence) + 1 < oldest:
+                reset = True
+            else:
+                backlog = [event for number, event in self.buffer if number > int(sequence)]
+        subscriber = EventSubscriber()
+        self.subscribers.add(subscriber)
+        return subscriber, backlog, reset
+    
+    def unsubscribe(self, subscriber: EventSubscriber):
+        self.subscribers.discard(subscriber)
+    
+    def stats(self) -> dict:
+        return {"subscribers": len(self.subscribers), "published": self.published, "lagged": self.lagged,
+                "external": self.external, "last_id": self.last_id()}
+
+event_broker = EventBroker(EVENTS_BUFFER_SIZE)
+
+SALE_EVENT_FIELDS = ("id", "sale_number", "date", "customer_id", "total")
+
+# Event type and payload for a document written to one of the collections
+def change_event(collection: str, document: dict, stock_only: bool = False) -> Optional[Tuple[str, dict]]:
+    if collection == "parts":
+        if stock_only:
+            return "part.stock", {"id": document["id"], "stock_quantity": document["stock_quantity"]}
+        return "part.changed", {field: document.get(field) for field in Part.model_fields}
+    if collection == "services":
+        return "service.changed", {field: document.get(field) for field in Service.model_fields}
+    if collection == "customers":
+        return "customer.changed", {field: document.get(field) for field in Customer.model_fields}
+    if collection == "sales":
+        return "sale.created", {field: document.get(field) for field in SALE_EVENT_FIELDS}
+    if collection == "settings":
+        return "setting.updated", {"key": document["key"], "value": document.get("value")}
+    return None
+
+def publish_change(collection: str, document: dict, stock_only: bool = False):
+    if event_broker.external:
+        return
+    event = change_event(collection, document, stock_only)
+    if event:
+        event_broker.publish(*event)
+
+def publish_deleted(collection: str, document_id: str):
+    if not event_broker.external:
+        event_broker.publish(f"{collection[:-1]}.deleted", {"id": document_id})
+
+# Collections whose large writes (imports, batch updates) publish a single
+# "<collection>.reloaded" event rather than one event per document
+def publish_reloaded(collection: str):
+    if not event_broker.external:
+        event_broker.publish(f"{collection}.reloaded", {})
+
+CHANGE_STREAM_COLLECTIONS = ["customers", "parts", "services", "sales", "settings", "low_stock"]
+# Part updates touching only these fields are published as part.stock
+STOCK_FIELDS = {"stock_quantity", "stock_holds"}
+
+def change_stream_event(change: dict) -> Optional[Tuple[str, dict]]:
+    collection = change["ns"]["coll"]
+    operation = change["operationType"]
+    if collection == "low_stock":
+        if operation == "insert":
+            return "part.low_stock", low_stock_alert(change["fullDocument"])
+        if operation == "delete" and change.get("fullDocumentBeforeChange"):
+            return "part.restocked", {"id": change["fullDocumentBeforeChange"]["id"]}
+        return None
+    if operation == "delete":
+        before = change.get("fullDocumentBeforeChange")
+        if not before or collection in ("sales", "settings"):
+            return None
+        return f"{collection[:-1]}.deleted", {"id": before.get("id")}
+    # Sales are only ever inserted by the API; later updates are bookkeeping
+    if collection == "sales" and operation != "insert":
+        return None
+    document = change.get("fullDocument")
+    if not document:
+        return None
+    updated = set(change.get("updateDescription", {}).get("updatedFields", {}))
+    stock_only = operation == "update" and bool(updated) and {field.split(".")[0] for field in updated} <= STOCK_FIELDS
+    return change_event(collection, document, stock_only)
+
+# Enables delete pre-images (MongoDB 6.0+) so deletes can be published with
+# the document id; returns False when the server cannot provide them
+async def enable_change_stream_pre_images() -> bool:
+    try:
+        for name in CHANGE_STREAM_COLLECTIONS:
+            if name not in await db.list_collection_names(filter={"name": name}):
+                await db.create_collection(name)
+            await db.command("collMod", name, changeStreamPreAndPostImages={"enabled": True})
+    except PyMongoError as error:
+        logger.warning("Change stream pre-images unavailable, publishing events in-process: %s", error)
+        return False
+    return True
+
+async def change_stream_loop():
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(
+                [{"$match": {"ns.coll": {"$in": CHANGE_STREAM_COLLECTIONS}}}],
+                full_document="updateLookup",
+                full_document_before_change="whenAvailable",
+                resume_after=resume_token
+            ) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    event = change_stream_event(change)
+                    if event:
+                        event_broker.publish(*event)
+        except PyMongoError as error:
+            logger.warning("Change stream failed, reopening: %s", error)
+            await asyncio.sleep(1)
+
+def format_event(event: dict) -> str:
+    data = orjson.dumps(event["data"]).decode()
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+async def stream_events(request: Request, subscriber: EventSubscriber, backlog: List[dict], reset: bool):
+    try:
+        yield "retry: 3000\n\n"
+        if reset:
+            yield format_event({"id": event_broker.last_id(), "type": "reset", "data": {}})
+        for event in backlog:
+            yield format_event(event)
+        # A lagged client gets what was queued before it fell behind, then the
+        # stream ends and the client resumes from the buffer with Last-Event-ID
+        while not (subscriber.lagged and subscriber.queue.empty()):
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        event_broker.unsubscribe(subscriber)
+
+# Low-stock set. low_stock holds one document per part at or below the
+# threshold, written when a write moves the part across it, so reads and
+# alerts cost O(low parts). Documents keep the stock and threshold seen at
+# the crossing. counters["low_stock"] records the threshold the set was
+# built with; a different threshold rebuilds it.
+def valid_threshold(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+# A stored value that is not a usable threshold (null from an empty form
+# field, text, a negative number) falls back to the default, so stock
+# comparisons never see it
+def low_stock_threshold() -> int:
+    default = DEFAULT_SETTINGS["low_stock_threshold"]
+    value = get_setting_value("low_stock_threshold", default)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    return value if valid_threshold(value) else default
+
+def low_stock_alert(document: dict) -> dict:
+    return {"id": document["id"], "stock_quantity": document["stock_quantity"], "threshold": document["threshold"]}
+
+async def read_stock_levels(part_filter: dict) -> List[dict]:
+    return await db.parts.find(part_filter, {"_id": 0, "id": 1, "stock_quantity": 1}).to_list(None)
+
+# Records the crossings among the given {id, stock_quantity} levels and
+# publishes part.low_stock / part.restocked for them
+async def update_low_stock(levels: List[dict]):
+    if not levels:
+        return
+    threshold = low_stock_threshold()
+    low = [level for level in levels if level["stock_quantity"] <= threshold]
+    above = [level["id"] for level in levels if level["stock_quantity"] > threshold]
+    
+    entered = []
+    if low:
+        operations = [
+            UpdateOne(
+                {"_id": level["id"]},
+                {"$setOnInsert": {"id": level["id"], "stock_quantity": level["stock_quantity"],
+                                  "threshold": threshold, "since": datetime.now()}},
+                upsert=True
+            )
+            for level in low
+        ]
+        try:
+            upserted = (await db.low_stock.bulk_write(operations, ordered=False)).upserted_ids
+        except BulkWriteError as error:
+            # A concurrent write recorded the same crossing first
+            upserted = {row["index"]: row["_id"] for row in error.details["upserted"]}
+        entered = [low[index] for index in upserted]
+    
+    restocked = []
+    if above:
+        restocked = [row["_id"] async for row in db.low_stock.find({"_id": {"$in": above}}, {"_id": 1})]
+        if restocked:
+            await db.low_stock.delete_many({"_id": {"$in": restocked}})
+    
+    if entered or restocked:
+        await bump_version("low_stock")
+    if not event_broker.external:
+        for level in entered:
+            event_broker.publish("part.low_stock", low_stock_alert({**level, "threshold": threshold}))
+        for part_id in restocked:
+            event_broker.publish("part.restocked", {"id": part_id})
+
+async def rebuild_low_stock():
+    threshold = low_stock_threshold()
+    low = await read_stock_levels({"stock_quantity": {"$lte": threshold}})
+    await db.low_stock.delete_many({"_id": {"$nin": [level["id"] for level in low]}})
+    if low:
+        now = datetime.now()
+        await db.low_stock.bulk_write([
+            UpdateOne(
+                {"_id": level["id"]},
+                {"$set": {"id": level["id"], "stock_quantity": level["stock_quantity"], "threshold": threshold},
+                 "$setOnInsert": {"since": now}},
+                upsert=True
+            )
+            for level in low
+        ], ordered=False)
+    await db.counters.update_one({"_id": "low_stock"}, {"$set": {"threshold": threshold}}, upsert=True)
+    await bump_version("low_stock")
+    if not event_broker.external:
+        event_broker.publish("low_stock.reloaded", {"threshold": threshold})
+
+async def ensure_low_stock():
+    state = await db.counters.find_one({"_id": "low_stock"})
+    if not state or state.get("threshold") != low_stock_threshold():
+        await rebuild_low_stock()
+
+# Background jobs. Each job is a document in jobs ({_id, type, payload,
+# status: pending|running|failed, attempts, run_at, locked_until,
+# last_error}) written with the data it follows from, so it survives a
+# crash. Its id also goes on this worker's queue so it normally runs at
+# once; the workers poll for retries, expired locks and jobs queued by other
+# workers. Finished jobs are deleted; jobs out of attempts stay as failed.
+# The queue is created on startup, in the event loop its workers run on.
+JOB_HANDLERS: Dict[str, Any] = {}
+job_queue: Optional[asyncio.Queue] = None
+
+def job_handler(job_type: str):
+    def register(function):
+        JOB_HANDLERS[job_type] = function
+        return function
+    return register
+
+def new_job(job_type: str, payload: dict) -> dict:
+    now = datetime.now()
+    return {"_id": str(uuid.uuid4()), "type": job_type, "payload": payload, "status": "pending",
+            "attempts": 0, "run_at": now, "created_at": now, "locked_until": None, "last_error": None}
+
+# Hands jobs already stored in jobs to this worker's queue
+def schedule_jobs(jobs: List[dict]):
+    if job_queue is None:
+        return
+    for job in jobs:
+        try:
+            job_queue.put_nowait(job["_id"])
+        except asyncio.QueueFull:
+            # The pollers pick up the rest
+            break
+
+async def claim_job(job_id: Optional[str] = None) -> Optional[dict]:
+    now = datetime.now()
+    due = {"$or": [
+        {"status": "pending", "run_at": {"$lte": now}},
+        {"status": "running", "locked_until": {"$lt": now}},
+    ]}
+    return await db.jobs.find_one_and_update(
+        {"_id": job_id, **due} if job_id else due,
+        {"$set": {"status": "running", "locked_until": now + timedelta(seconds=JOB_LOCK_SECONDS)},
+         "$inc": {"attempts": 1}},
+        sort=None if job_id else [("run_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def run_job(job: dict):
+    started = time.perf_counter()
+    try:
+        handler = JOB_HANDLERS.get(job["type"])
+        if handler is None:
+            raise LookupError(f"No handler for job type {job['type']!r}")
+        await handler(**job["payload"])
+    except Exception as error:
+        if job["attempts"] >= JOB_MAX_ATTEMPTS:
+            logger.error("Job %s (%s) failed after %d attempts: %r", job["_id"], job["type"], job["attempts"], error)
+            outcome, update = "failed", {"status": "failed"}
+        else:
+            delay = JOB_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1) * random.uniform(0.8, 1.2)
+            outcome, update = "retry", {"status": "pending", "run_at": datetime.now() + timedelta(seconds=delay)}
+        await db.jobs.update_one(
+            {"_id": job["_id"]},
+            {"$set": {**update, "locked_until": None, "last_error": repr(error)[:1000]}}
+        )
     else:
-        new_number = 1
+        outcome = "done"
+        await db.jobs.delete_one({"_id": job["_id"]})
+    JOB_DURATION.observe((job["type"], outcome), time.perf_counter() - started)
+    JOB_RUNS.inc((job["type"], outcome))
+
+async def job_worker():
+    while True:
+        try:
+            try:
+                job_id = await asyncio.wait_for(job_queue.get(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                job_id = None
+            job = await claim_job(job_id)
+            while job:
+                await run_job(job)
+                # After a poll, keep draining whatever else is due
+                job = None if job_id else await claim_job()
+        except Exception as error:
+            # A dead worker would shrink the pool silently; log and carry on
+            logger.warning("Job worker error: %r", error)
+            await asyncio.sleep(1)
+
+# Safe to run any number of times: apply_sale_to_rollup counts each sale
+# once. A missing sale is one whose insert failed after its jobs were stored.
+@job_handler("rollup_sale")
+async def rollup_sale_job(sale_id: str):
+    sale = await db.sales.find_one({"id": sale_id}, SALE_PROJECTION)
+    if sale and await apply_sale_to_rollup(Sale(**sale)):
+        # Reports are tagged with the sales version; the rollup changed them
+        await bump_version("sales")
+
+# Stored with the jobs of a sale committed without a transaction. A missing
+# sale never committed: the stock it still holds goes back. A recorded sale
+# only has its leftover holds cleared.
+@job_handler("release_stock_holds")
+async def release_stock_holds_job(sale_id: str, quantities: Dict[str, int]):
+    if await db.sales.find_one({"id": sale_id}, {"_id": 1}):
+        await db.parts.update_many(
+            {"id": {"$in": list(quantities)}, "stock_holds": sale_id}, {"$pull": {"stock_holds": sale_id}}
+        )
+        return
+    if quantities and await release_stock_holds(quantities, sale_id):
+        await sale_stock_job(list(quantities))
+
+@job_handler("sale_stock")
+async def sale_stock_job(part_ids: List[str]):
+    levels = await read_stock_levels({"id": {"$in": part_ids}})
+    await update_low_stock(levels)
+    for level in levels:
+        publish_change("parts", level, stock_only=True)
+
+# Search keys. Customers carry a digits-only phone and a case- and
+# accent-folded name next to the original fields so that prefix searches are
+# anchored regexes on an index.
+def normalize_phone(phone: str) -> str:
+    return re.sub(r"\D", "", phone or "")
+
+def fold_text(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold().strip()
+
+def customer_search_fields(data: dict) -> dict:
+    fields = {}
+    if data.get("phone") is not None:
+        fields["phone_normalized"] = normalize_phone(data["phone"])
+    if data.get("name") is not None:
+        fields["name_folded"] = fold_text(data["name"])
+    return fields
+
+def prefix_query(prefix: str) -> dict:
+    return {"$regex": "^" + re.escape(prefix)}
+
+# Fills the search keys of customers created before they existed
+async def backfill_customer_search_fields():
+    updates = []
+    async for customer in db.customers.find(
+        {"$or": [{"phone_normalized": {"$exists": False}}, {"name_folded": {"$exists": False}}]},
+        {"_id": 0, "id": 1, "name": 1, "phone": 1}
+    ):
+        updates.append(UpdateOne({"id": customer["id"]}, {"$set": customer_search_fields(customer)}))
+        if len(updates) >= 1000:
+            await db.customers.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await db.customers.bulk_write(updates, ordered=False)
+
+# Bulk imports. The request body is read as a stream of CSV records (first
+# line is the header) or NDJSON lines, validated against the *Create model in
+# batches and written with one bulk operation per batch.
+async def iter_import_lines(request: Request):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        if lines:
+            yield [line + "\n" for line in lines]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield [pending]
+
+class MoreLinesNeeded(Exception):
+    pass
+
+# Line iterator for a single csv.reader fed as the body arrives. When the
+# reader asks for a line that has not arrived, the lines of the record it was
+# parsing are put back and MoreLinesNeeded is raised; the reader starts every
+# row afresh, so the next call parses that record again from the top.
+class ImportLineFeed:
+    def __init__(self):
+        self.lines: deque = deque()
+        self.record: List[str] = []
+        self.finished = False
     
-    return f"{today}{new_number:03d}"
+    def __iter__(self):
+        return self
+    
+    def __next__(self) -> str:
+        if not self.lines:
+            if self.finished:
+                raise StopIteration
+            self.lines.extendleft(reversed(self.record))
+            self.record = []
+            raise MoreLinesNeeded
+        line = self.lines.popleft()
+        self.record.append(line)
+        return line
+
+# Yields (values, error) per CSV record; csv.reader handles quoting, so a
+# quote inside an unquoted field (3/8") stays literal. Malformed records are
+# reported as errors and parsing resumes on the next line.
+async def iter_csv_records(request: Request):
+    feed = ImportLineFeed()
+    reader = csv.reader(feed)
+    
+    def parsed():
+        while True:
+            try:
+                values = next(reader)
+            except (MoreLinesNeeded, StopIteration):
+                return
+            except csv.Error as error:
+                feed.record = []
+                yield None, str(error)
+                continue
+            feed.record = []
+            if values:
+                yield values, None
+    
+    async for lines in iter_import_lines(request):
+        feed.lines.extend(lines)
+        for record in parsed():
+            yield record
+    feed.finished = True
+    for record in parsed():
+        yield record
+
+async def iter_import_rows(request: Request, import_format: str):
+    row_number = 0
+    if import_format == "csv":
+        header = None
+        async for values, error in iter_csv_records(request):
+            if header is None:
+                if error:
+                    raise HTTPException(status_code=400, detail=f"Invalid CSV header: {error}")
+                header = [column.strip() for column in values]
+                continue
+            row_number += 1
+            if error:
+                yield row_number, None, error
+                continue
+            yield row_number, {column: (value if value != "" else None) for column, value in zip(header, values)}, None
+        return
+    
+    async for lines in iter_import_lines(request):
+        for line in lines:
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("Expected a JSON object")
+                yield row_number, row, None
+            except ValueError as error:
+                yield row_number, None, str(error)
+
+def import_format_for(request: Request, requested: Optional[str]) -> str:
+    if requested:
+        if requested not in ("csv", "ndjson"):
+            raise HTTPException(status_code=400, detail="Invalid format. Use csv or ndjson")
+        return requested
+    return "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+# write_batch receives [(row_number, validated model)] and returns
+# (inserted, updated, [(row_number, error)])
+async def run_import(request: Request, import_format: str, model, write_batch):
+    report = {"received": 0, "inserted": 0, "updated": 0, "failed": 0, "errors": []}
+    
+    def add_error(row_number: int, error):
+        report["failed"] += 1
+        if len(report["errors"]) < IMPORT_MAX_ERRORS:
+            report["errors"].append({"row": row_number, "error": error})
+    
+    async def flush(batch):
+        inserted, updated, errors = await write_batch(batch)
+        report["inserted"] += inserted
+        report["updated"] += updated
+        for row_number, error in errors:
+            add_error(row_number, error)
+    
+    batch = []
+    async for row_number, row, parse_error in iter_import_rows(request, import_format):
+        report["received"] += 1
+        if parse_error:
+            add_error(row_number, parse_error)
+            continue
+        try:
+            batch.append((row_number, model(**row)))
+        except ValidationError as error:
+            add_error(row_number, json.loads(error.json(include_url=False)))
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    
+    report["errors_truncated"] = report["failed"] > len(report["errors"])
+    return report
+
+# Unordered insert_many; rows rejected by the server are reported by index
+async def insert_import_batch(collection, batch, documents):
+    try:
+        result = await collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids), 0, []
+    except BulkWriteError as error:
+        details = error.details
+        errors = [(batch[write_error["index"]][0], write_error["errmsg"]) for write_error in details["writeErrors"]]
+        return details["nInserted"], 0, errors
 
 # Default settings
 DEFAULT_SETTINGS = {
@@ -153,40 +1783,463 @@ DEFAULT_SETTINGS = {
 }
 
 async def initialize_settings():
-    for key, value in DEFAULT_SETTINGS.items():
-        existing = await db.settings.find_one({"key": key})
-        if not existing:
-            setting = Setting(key=key, value=value)
-            await db.settings.insert_one(setting.model_dump())
+    existing = {setting["key"] async for setting in db.settings.find({}, {"_id": 0, "key": 1})}
+    missing = [Setting(key=key, value=value).model_dump()
+               for key, value in DEFAULT_SETTINGS.items() if key not in existing]
+    if missing:
+        try:
+            await db.settings.insert_many(missing, ordered=False)
+        except PyMongoError:
+            # Another worker inserted the same defaults concurrently
+            pass
+        await bump_version("settings")
 
 # Startup event
 @app.on_event("startup")
 async def startup_event():
+    global transactions_enabled, job_queue
+    job_queue = asyncio.Queue(JOB_QUEUE_SIZE)
+    transactions_enabled = await detect_transaction_support()
+    if CHANGE_STREAMS != "off" and await is_replica_set() and await enable_change_stream_pre_images():
+        event_broker.external = True
+        background_tasks.append(asyncio.create_task(change_stream_loop()))
+    await ensure_indexes()
     await initialize_settings()
+    await backfill_customer_search_fields()
+    await load_settings_cache()
+    await ensure_low_stock()
+    background_tasks.append(asyncio.create_task(cache_refresh_loop()))
+    for _ in range(JOB_WORKERS):
+        background_tasks.append(asyncio.create_task(job_worker()))
+    
+    # Backfill rollups once for databases created before sales_daily existed.
+    # Workers starting together race for the lock; the winner rebuilds.
+    if not await db.sales_daily.find_one({}, {"_id": 1}) and await db.sales.find_one({}, {"_id": 1}):
+        if await acquire_lock("rebuild_rollups", ROLLUP_REBUILD_LOCK_SECONDS):
+            try:
+                if not await db.sales_daily.find_one({}, {"_id": 1}):
+                    await rebuild_sales_rollups()
+            finally:
+                await release_lock("rebuild_rollups")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+
+@app.middleware("http")
+async def conditional_get_middleware(request: Request, call_next):
+    names = etag_collections(request.url.path) if request.method == "GET" else None
+    if not names or request.url.path.endswith("/export"):
+        return await call_next(request)
+    
+    etag = await compute_etag(request, names)
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    # Whether the body would be compressed is only known once it exists, so
+    # either tag the client may hold for this request answers 304
+    if_none_match = request.headers.get("if-none-match")
+    matched = etag_matches(if_none_match, etag) or etag_matches(if_none_match, encoded_etag(etag, encoding))
+    if matched:
+        return Response(status_code=304, headers={"ETag": matched, "Cache-Control": "no-cache"})
+    
+    cached = compressed_cache.get((etag, encoding)) if encoding else None
+    if cached:
+        compressed_cache.move_to_end((etag, encoding))
+        headers, body = cached
+        return Response(body, headers=headers)
+    
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# Response compression (brotli when installed, otherwise gzip)
+compressed_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+compressed_cache_bytes = 0
+
+def cache_compressed(key: tuple, headers: dict, body: bytes):
+    global compressed_cache_bytes
+    if len(body) > COMPRESSION_CACHE_BYTES:
+        return
+    previous = compressed_cache.pop(key, None)
+    if previous:
+        compressed_cache_bytes -= len(previous[1])
+    compressed_cache[key] = (headers, body)
+    compressed_cache_bytes += len(body)
+    while len(compressed_cache) > COMPRESSION_CACHE_ENTRIES or compressed_cache_bytes > COMPRESSION_CACHE_BYTES:
+        _, (_, evicted) = compressed_cache.popitem(last=False)
+        compressed_cache_bytes -= len(evicted)
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/csv", "text/plain", "text/html")
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(token.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return zlib.compress(body, 6, wbits=31)
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=5)
+        else:
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+    
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request_headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        encoding = negotiate_encoding(request_headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        
+        start_message = None
+        compressor = None
+        passthrough = False
+        buffered = None
+        
+        async def compressing_send(message):
+            nonlocal start_message, compressor, passthrough, buffered
+            
+            if message["type"] == "http.response.start":
+                headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in message["headers"]}
+                content_type = headers.get("content-type", "")
+                content_length = headers.get("content-length")
+                passthrough = (
+                    "content-encoding" in headers
+                    or message["status"] in (204, 304)
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                    or (content_length is not None and int(content_length) < self.minimum_size)
+                )
+                if passthrough:
+                    await send(message)
+                    return
+                start_message = message
+                # Bodies of known size are compressed in one go, the others
+                # (StreamingResponse) chunk by chunk
+                if content_length is not None:
+                    buffered = []
+                return
+            
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            headers = MutableHeaders(raw=start_message["headers"])
+            
+            if buffered is not None:
+                buffered.append(body)
+                if more_body:
+                    return
+                body = compress_body(b"".join(buffered), encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag:
+                    headers["ETag"] = encoded_etag(etag, encoding)
+                    if (start_message["status"] == 200 and scope["path"] in COMPRESSION_CACHE_PATHS
+                            and COMPRESSION_CACHE_ENTRIES > 0):
+                        cache_compressed((etag, encoding), dict(headers), body)
+                await send(start_message)
+                await send({"type": "http.response.body", "body": body})
+                return
+            
+            if compressor is None:
+                compressor = StreamCompressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "etag" in headers:
+                    headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                await send(start_message)
+            
+            data = compressor.chunk(body)
+            if not more_body:
+                data += compressor.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+        
+        await self.app(scope, receive, compressing_send)
+
+# Route template of a request, for labels and logs. Responses sent before the
+# router runs (304s and compressed-cache hits) carry no route in the scope,
+# so the template is matched here; unknown paths share "unmatched".
+def route_template(scope) -> str:
+    route = scope.get("route")
+    if route:
+        return route.path
+    for candidate in app.router.routes:
+        if candidate.matches(scope)[0] == Match.FULL:
+            return candidate.path
+    return "unmatched"
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status = 500
+        
+        async def recording_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        HTTP_IN_FLIGHT.inc((), 1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, recording_send)
+        finally:
+            HTTP_IN_FLIGHT.inc((), -1)
+            # Route templates keep the label set bounded
+            HTTP_REQUEST_DURATION.observe(
+                (scope["method"], route_template(scope), str(status)),
+                time.perf_counter() - started
+            )
+
+# Only one request is profiled at a time. cProfile follows the thread, so
+# other requests interleaved on the event loop show up in the same profile.
+profile_lock = threading.Lock()
+
+class SlowRequestMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    def should_profile(self, scope) -> bool:
+        if PROFILE_HEADER and (b"x-profile", b"1") in scope["headers"]:
+            return True
+        return PROFILE_SAMPLE_RATE > 0 and random.randrange(PROFILE_SAMPLE_RATE) == 0
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        stats = {"path": scope["path"], "db_calls": 0, "db_time": 0.0, "serialize_time": 0.0}
+        token = request_stats.set(stats)
+        status = 500
+        streaming = False
+        
+        async def recording_send(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # Event streams stay open on purpose and are never slow requests
+                streaming = any(name == b"content-type" and value.startswith(b"text/event-stream")
+                                for name, value in message.get("headers", []))
+            await send(message)
+        
+        profiler = None
+        if self.should_profile(scope) and profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, recording_send)
+        finally:
+            duration = time.perf_counter() - started
+            request_stats.reset(token)
+            route_path = route_template(scope)
+            
+            profile_file = None
+            if profiler is not None:
+                profiler.disable()
+                profile_lock.release()
+                profile_dir = LOG_DIR / "profiles"
+                profile_name = re.sub(r"[^A-Za-z0-9]+", "_", f"{scope['method']}_{route_path}").strip("_")
+                profile_file = profile_dir / f"{datetime.now():%Y%m%d-%H%M%S-%f}_{profile_name}.pstats"
+                try:
+                    profile_dir.mkdir(parents=True, exist_ok=True)
+                    profiler.dump_stats(str(profile_file))
+                except OSError as error:
+                    logger.warning("Could not write profile: %s", error)
+                    profile_file = None
+            
+            if (duration * 1000 >= SLOW_REQUEST_MS and not streaming) or profile_file:
+                write_slow_log("slow_requests.log", {
+                    "ts": datetime.now().isoformat(),
+                    "method": scope["method"],
+                    "route": route_path,
+                    "path": scope["path"],
+                    "query": scope.get("query_string", b"").decode("latin-1"),
+                    "path_params": scope.get("path_params", {}),
+                    "status": status,
+                    "duration_ms": round(duration * 1000, 2),
+                    "db_calls": stats["db_calls"],
+                    "db_time_ms": round(stats["db_time"] * 1000, 2),
+                    "serialize_ms": round(stats["serialize_time"] * 1000, 2),
+                    "profile": str(profile_file) if profile_file else None,
+                })
+
+# Registered last so they wrap the HTTP middlewares above; CORS is outermost
+# so that 304 and cached responses also carry the CORS headers
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(SlowRequestMiddleware)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Idempotent-Replayed"],
+)
 
 # Health check
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    cache_stats = Counter("oficina_catalog_cache", "Catalog cache hits, misses and size.", ("cache", "stat"), kind="gauge")
+    for name, cache in catalog_caches.items():
+        for stat in ("hits", "misses", "size"):
+            cache_stats.set((name, stat), cache.stats()[stat])
+    
+    lines = []
+    job_depth = Counter("oficina_jobs", "Background jobs stored in the outbox by status.", ("status",), kind="gauge")
+    for status in ("pending", "running", "failed"):
+        job_depth.set((status,), 0)
+    async for row in db.jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        job_depth.set((row["_id"],), row["count"])
+    job_queue_size = Counter("oficina_job_queue_size", "Job ids waiting on this worker's queue.", (), kind="gauge")
+    job_queue_size.set((), job_queue.qsize() if job_queue else 0)
+    
+    for metric in (HTTP_REQUEST_DURATION, HTTP_IN_FLIGHT, MONGO_COMMAND_DURATION, MONGO_COMMAND_FAILURES,
+                   MONGO_CHECKOUT_WAIT, MONGO_CHECKOUT_FAILURES, cache_stats, JOB_DURATION, JOB_RUNS,
+                   job_depth, job_queue_size):
+        lines.extend(metric.render())
+    lines.append("# HELP oficina_compressed_cache_entries Compressed response bodies kept in memory.")
+    lines.append("# TYPE oficina_compressed_cache_entries gauge")
+    lines.append(f"oficina_compressed_cache_entries {len(compressed_cache)}")
+    lines.append("# HELP oficina_compressed_cache_bytes Bytes of compressed response bodies kept in memory.")
+    lines.append("# TYPE oficina_compressed_cache_bytes gauge")
+    lines.append(f"oficina_compressed_cache_bytes {compressed_cache_bytes}")
+    lines.append("# HELP oficina_event_subscribers Clients connected to /api/events.")
+    lines.append("# TYPE oficina_event_subscribers gauge")
+    lines.append(f"oficina_event_subscribers {len(event_broker.subscribers)}")
+    lines.append("# HELP oficina_events_published_total Change events published by this worker.")
+    lines.append("# TYPE oficina_events_published_total counter")
+    lines.append(f"oficina_events_published_total {event_broker.published}")
+    lines.append("# HELP oficina_event_clients_lagged_total Event clients disconnected for falling behind.")
+    lines.append("# TYPE oficina_event_clients_lagged_total counter")
+    lines.append(f"oficina_event_clients_lagged_total {event_broker.lagged}")
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    return {name: cache.stats() for name, cache in catalog_caches.items()}
+
+# Server-Sent Events feed of changes. Browsers reconnect with the
+# Last-Event-ID header; last_event_id does the same for the first connection.
+@app.get("/api/events")
+async def get_events(request: Request, last_event_id: Optional[str] = None):
+    subscriber, backlog, reset = event_broker.subscribe(request.headers.get("last-event-id") or last_event_id)
+    return StreamingResponse(
+        stream_events(request, subscriber, backlog, reset),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Customer endpoints
 @app.get("/api/customers", response_model=List[Customer])
-async def get_customers():
-    customers = await db.customers.find().to_list(1000)
-    return customers
+async def get_customers(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None,
+                        fields: Optional[str] = None):
+    projection, model = select_fields(Customer, fields)
+    customers = await paginate(db.customers, response, limit, cursor, projection=projection)
+    return trusted_response(customers, response, model)
+
+# Collection size for the dashboard, from the collection metadata rather than
+# a scan (approximate after an unclean mongod shutdown)
+@app.get("/api/customers/count")
+async def count_customers():
+    return {"count": await db.customers.estimated_document_count()}
 
 @app.post("/api/customers", response_model=Customer)
 async def create_customer(customer: CustomerCreate):
     customer_data = Customer(**customer.model_dump())
-    await db.customers.insert_one(customer_data.model_dump())
+    document = customer_data.model_dump()
+    await db.customers.insert_one({**document, **customer_search_fields(document)})
+    await bump_version("customers")
+    publish_change("customers", document)
     return customer_data
 
+@app.post("/api/customers/import")
+async def import_customers(request: Request, format: Optional[str] = None):
+    async def write_batch(batch):
+        documents = []
+        for _, customer in batch:
+            document = Customer(**customer.model_dump()).model_dump()
+            documents.append({**document, **customer_search_fields(document)})
+        return await insert_import_batch(db.customers, batch, documents)
+    
+    try:
+        return await run_import(request, import_format_for(request, format), CustomerCreate, write_batch)
+    finally:
+        await bump_version("customers")
+        publish_reloaded("customers")
+
+# Digits-only queries match the phone prefix, anything else the name prefix
+@app.get("/api/customers/search", response_model=List[Customer])
+async def search_customers(q: str, limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT), fields: Optional[str] = None):
+    digits = normalize_phone(q)
+    if digits and not re.search(r"[^\d\s()+.-]", q):
+        query, sort_field = {"phone_normalized": prefix_query(digits)}, "phone_normalized"
+    else:
+        query, sort_field = {"name_folded": prefix_query(fold_text(q))}, "name_folded"
+    
+    projection, model = select_fields(Customer, fields)
+    customers = await db.customers.find(query, projection).sort(sort_field, 1).limit(limit).to_list(limit)
+    return trusted_response(customers, model=model)
+
 @app.get("/api/customers/{customer_id}", response_model=Customer)
-async def get_customer(customer_id: str):
-    customer = await db.customers.find_one({"id": customer_id})
+async def get_customer(customer_id: str, fields: Optional[str] = None):
+    projection, model = select_fields(Customer, fields)
+    customer = await db.customers.find_one({"id": customer_id}, projection)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return customer
+    return trusted_response(customer, model=model)
 
 @app.put("/api/customers/{customer_id}", response_model=Customer)
 async def update_customer(customer_id: str, customer_update: CustomerUpdate):
@@ -197,48 +2250,228 @@ async def update_customer(customer_id: str, customer_update: CustomerUpdate):
     
     result = await db.customers.update_one(
         {"id": customer_id}, 
-        {"$set": update_data}
+        {"$set": {**update_data, **customer_search_fields(update_data)}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
+    await bump_version("customers")
     
-    customer = await db.customers.find_one({"id": customer_id})
-    return customer
+    customer = await db.customers.find_one({"id": customer_id}, CUSTOMER_PROJECTION)
+    publish_change("customers", customer)
+    return trusted_response(customer)
 
 @app.delete("/api/customers/{customer_id}")
 async def delete_customer(customer_id: str):
     result = await db.customers.delete_one({"id": customer_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
+    await bump_version("customers")
+    publish_deleted("customers", customer_id)
     return {"message": "Customer deleted successfully"}
 
 # Parts endpoints
 @app.get("/api/parts", response_model=List[Part])
-async def get_parts():
-    parts = await db.parts.find().to_list(1000)
-    return parts
+async def get_parts(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None,
+                    fields: Optional[str] = None):
+    projection, model = select_fields(Part, fields)
+    cache = catalog_caches["parts"]
+    if await cache.ready():
+        parts = paginate_documents(list(cache.documents.values()), response, limit, cursor)
+        return trusted_response(project_documents(parts, projection), response, model)
+    
+    parts = await paginate(db.parts, response, limit, cursor, projection=projection)
+    return trusted_response(parts, response, model)
+
+@app.get("/api/parts/count")
+async def count_parts():
+    cache = catalog_caches["parts"]
+    if await cache.ready():
+        return {"count": len(cache.documents)}
+    return {"count": await db.parts.estimated_document_count()}
 
 @app.post("/api/parts", response_model=Part)
 async def create_part(part: PartCreate):
     part_data = Part(**part.model_dump())
     await db.parts.insert_one(part_data.model_dump())
+    catalog_caches["parts"].put(part_data.model_dump())
+    await catalog_written("parts")
+    publish_change("parts", part_data.model_dump())
+    await update_low_stock([part_data.model_dump()])
     return part_data
 
+# Parts are upserted by reference_code: existing parts get the imported
+# fields, new ones get an id and created_at
+@app.post("/api/parts/import")
+async def import_parts(request: Request, format: Optional[str] = None):
+    async def write_batch(batch):
+        operations = [
+            UpdateOne(
+                {"reference_code": part.reference_code},
+                {
+                    "$set": part.model_dump(),
+                    "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": datetime.now()}
+                },
+                upsert=True
+            )
+            for _, part in batch
+        ]
+        try:
+            result = await db.parts.bulk_write(operations, ordered=False)
+            counts = result.upserted_count, result.matched_count, []
+        except BulkWriteError as error:
+            details = error.details
+            errors = [(batch[write_error["index"]][0], write_error["errmsg"]) for write_error in details["writeErrors"]]
+            counts = details["nUpserted"], details["nMatched"], errors
+        await update_low_stock(await read_stock_levels(
+            {"reference_code": {"$in": [part.reference_code for _, part in batch]}}
+        ))
+        return counts
+    
+    try:
+        return await run_import(request, import_format_for(request, format), PartCreate, write_batch)
+    finally:
+        catalog_caches["parts"].invalidate()
+        await catalog_written("parts")
+        publish_reloaded("parts")
+
+# Applies a percentage price change (optionally limited to ids or a
+# reference_code prefix) and per-part price and stock adjustments, in
+# order. Explicit per-part values run last and win.
+# A negative stock_delta only applies while the stock covers it, so stock
+# never goes below zero. Those conditional adjustments are written on their
+# own, in order, so their matched count tells whether they applied; the
+# others apply to every existing id. Ids that were not applied are listed
+# with the reason.
+@app.patch("/api/parts/batch")
+async def batch_update_parts(batch: PartBatchUpdate):
+    # (operation, (id, filter, update) of a conditional adjustment or None)
+    operations = []
+    
+    change = batch.price_change
+    if change:
+        if not change.fields or not set(change.fields) <= {"cost_price", "sale_price"}:
+            raise HTTPException(status_code=400, detail="price_change.fields must be cost_price and/or sale_price")
+        if change.percent <= -100:
+            raise HTTPException(status_code=400, detail="price_change.percent must be greater than -100")
+        part_filter = {}
+        if change.ids is not None:
+            part_filter["id"] = {"$in": change.ids}
+        if change.reference_code_prefix:
+            part_filter["reference_code"] = prefix_query(change.reference_code_prefix)
+        factor = 1 + change.percent / 100
+        operations.append((UpdateMany(part_filter, [
+            {"$set": {field: {"$round": [{"$multiply": [f"${field}", factor]}, 2]} for field in change.fields}}
+        ]), None))
+    
+    for adjustment in batch.updates:
+        if adjustment.stock_quantity is not None and adjustment.stock_delta is not None:
+            raise HTTPException(status_code=400, detail=f"Part {adjustment.id}: use stock_quantity or stock_delta, not both")
+        if adjustment.stock_quantity is not None and adjustment.stock_quantity < 0:
+            raise HTTPException(status_code=400, detail=f"Part {adjustment.id}: stock_quantity cannot be negative")
+        update = {}
+        values = adjustment.model_dump(include={"cost_price", "sale_price", "stock_quantity"}, exclude_none=True)
+        if values:
+            update["$set"] = values
+        part_filter = {"id": adjustment.id}
+        conditional = None
+        if adjustment.stock_delta is not None:
+            update["$inc"] = {"stock_quantity": adjustment.stock_delta}
+            if adjustment.stock_delta < 0:
+                part_filter["stock_quantity"] = {"$gte": -adjustment.stock_delta}
+                conditional = (adjustment.id, part_filter, update)
+        if not update:
+            raise HTTPException(status_code=400, detail=f"Part {adjustment.id}: no data to update")
+        operations.append((UpdateOne(part_filter, update), conditional))
+    
+    if not operations:
+        raise HTTPException(status_code=400, detail="No data to update")
+    
+    # Requested ids are checked before the write: a price change only
+    # reports ids that do not exist
+    price_change_ids = change.ids if change and change.ids else []
+    requested_ids = list(dict.fromkeys([*price_change_ids, *(adjustment.id for adjustment in batch.updates)]))
+    existing = {part["id"] for part in await db.parts.find(
+        {"id": {"$in": requested_ids}}, {"_id": 0, "id": 1}
+    ).to_list(None)} if requested_ids else set()
+    
+    matched_count = modified_count = 0
+    applied = {adjustment.id for adjustment in batch.updates if adjustment.id in existing}
+    conditional_missed = set()
+    pending = []
+    
+    async def write_pending():
+        nonlocal matched_count, modified_count
+        if pending:
+            result = await db.parts.bulk_write(pending, ordered=True)
+            matched_count += result.matched_count
+            modified_count += result.modified_count
+            pending.clear()
+    
+    for operation, conditional in operations:
+        if conditional is None:
+            pending.append(operation)
+            continue
+        await write_pending()
+        part_id, part_filter, update = conditional
+        result = await db.parts.update_one(part_filter, update)
+        matched_count += result.matched_count
+        modified_count += result.modified_count
+        if not result.matched_count:
+            conditional_missed.add(part_id)
+    await write_pending()
+    applied -= conditional_missed
+    
+    not_applied = {part_id: "not_found" for part_id in requested_ids if part_id not in existing}
+    for adjustment in batch.updates:
+        if adjustment.id not in applied and adjustment.id not in not_applied:
+            short = adjustment.stock_delta is not None and adjustment.stock_delta < 0
+            not_applied[adjustment.id] = "insufficient_stock" if short else "not_found"
+    
+    catalog_caches["parts"].invalidate()
+    await catalog_written("parts")
+    publish_reloaded("parts")
+    
+    stock_ids = [adjustment.id for adjustment in batch.updates
+                 if adjustment.id in existing and (adjustment.stock_quantity is not None or adjustment.stock_delta is not None)]
+    if stock_ids:
+        await update_low_stock(await read_stock_levels({"id": {"$in": stock_ids}}))
+    
+    return {
+        "matched_count": matched_count,
+        "modified_count": modified_count,
+        "not_applied": [{"id": part_id, "reason": reason} for part_id, reason in not_applied.items()],
+    }
+
+@app.get("/api/parts/search", response_model=List[Part])
+async def search_parts(q: str, limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT), fields: Optional[str] = None):
+    projection, model = select_fields(Part, fields)
+    parts = await db.parts.find(
+        {"reference_code": prefix_query(q.strip())}, projection
+    ).sort("reference_code", 1).limit(limit).to_list(limit)
+    return trusted_response(parts, model=model)
+
+# The stock is checked again on read: a job that read a low level before a
+# restock can record the crossing after the restock removed it
 @app.get("/api/parts/low-stock", response_model=List[Part])
 async def get_low_stock_parts():
-    threshold_setting = await db.settings.find_one({"key": "low_stock_threshold"})
-    threshold = threshold_setting["value"] if threshold_setting else 5
-    
-    parts = await db.parts.find({"stock_quantity": {"$lte": threshold}}).to_list(1000)
-    return parts
+    part_ids = [row["_id"] async for row in db.low_stock.find({}, {"_id": 1})]
+    part_filter = {"id": {"$in": part_ids}, "stock_quantity": {"$lte": low_stock_threshold()}}
+    parts = await db.parts.find(part_filter, PART_PROJECTION).to_list(None) if part_ids else []
+    return trusted_response(parts)
 
 @app.get("/api/parts/{part_id}", response_model=Part)
-async def get_part(part_id: str):
-    part = await db.parts.find_one({"id": part_id})
+async def get_part(part_id: str, fields: Optional[str] = None):
+    projection, model = select_fields(Part, fields)
+    cache = catalog_caches["parts"]
+    if await cache.ready():
+        part = cache.documents.get(part_id)
+        part = project_documents([part], projection)[0] if part else None
+    else:
+        part = await db.parts.find_one({"id": part_id}, projection)
     if not part:
         raise HTTPException(status_code=404, detail="Part not found")
-    return part
+    return trusted_response(part, model=model)
 
 @app.put("/api/parts/{part_id}", response_model=Part)
 async def update_part(part_id: str, part_update: PartUpdate):
@@ -255,34 +2488,79 @@ async def update_part(part_id: str, part_update: PartUpdate):
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Part not found")
     
-    part = await db.parts.find_one({"id": part_id})
-    return part
+    part = await db.parts.find_one({"id": part_id}, PART_PROJECTION)
+    catalog_caches["parts"].put(part)
+    await catalog_written("parts")
+    publish_change("parts", part)
+    if "stock_quantity" in update_data:
+        await update_low_stock([part])
+    return trusted_response(part)
 
 @app.delete("/api/parts/{part_id}")
 async def delete_part(part_id: str):
     result = await db.parts.delete_one({"id": part_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Part not found")
+    catalog_caches["parts"].remove(part_id)
+    await catalog_written("parts")
+    await db.low_stock.delete_one({"_id": part_id})
+    publish_deleted("parts", part_id)
     return {"message": "Part deleted successfully"}
 
 # Services endpoints
 @app.get("/api/services", response_model=List[Service])
-async def get_services():
-    services = await db.services.find().to_list(1000)
-    return services
+async def get_services(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None,
+                       fields: Optional[str] = None):
+    projection, model = select_fields(Service, fields)
+    cache = catalog_caches["services"]
+    if await cache.ready():
+        services = paginate_documents(list(cache.documents.values()), response, limit, cursor)
+        return trusted_response(project_documents(services, projection), response, model)
+    
+    services = await paginate(db.services, response, limit, cursor, projection=projection)
+    return trusted_response(services, response, model)
+
+@app.get("/api/services/count")
+async def count_services():
+    cache = catalog_caches["services"]
+    if await cache.ready():
+        return {"count": len(cache.documents)}
+    return {"count": await db.services.estimated_document_count()}
 
 @app.post("/api/services", response_model=Service)
 async def create_service(service: ServiceCreate):
     service_data = Service(**service.model_dump())
     await db.services.insert_one(service_data.model_dump())
+    catalog_caches["services"].put(service_data.model_dump())
+    await catalog_written("services")
+    publish_change("services", service_data.model_dump())
     return service_data
 
+@app.post("/api/services/import")
+async def import_services(request: Request, format: Optional[str] = None):
+    async def write_batch(batch):
+        documents = [Service(**service.model_dump()).model_dump() for _, service in batch]
+        return await insert_import_batch(db.services, batch, documents)
+    
+    try:
+        return await run_import(request, import_format_for(request, format), ServiceCreate, write_batch)
+    finally:
+        catalog_caches["services"].invalidate()
+        await catalog_written("services")
+        publish_reloaded("services")
+
 @app.get("/api/services/{service_id}", response_model=Service)
-async def get_service(service_id: str):
-    service = await db.services.find_one({"id": service_id})
+async def get_service(service_id: str, fields: Optional[str] = None):
+    projection, model = select_fields(Service, fields)
+    cache = catalog_caches["services"]
+    if await cache.ready():
+        service = cache.documents.get(service_id)
+        service = project_documents([service], projection)[0] if service else None
+    else:
+        service = await db.services.find_one({"id": service_id}, projection)
     if not service:
         raise HTTPException(status_code=404, detail="Service not found")
-    return service
+    return trusted_response(service, model=model)
 
 @app.put("/api/services/{service_id}", response_model=Service)
 async def update_service(service_id: str, service_update: ServiceUpdate):
@@ -299,24 +2577,151 @@ async def update_service(service_id: str, service_update: ServiceUpdate):
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Service not found")
     
-    service = await db.services.find_one({"id": service_id})
-    return service
+    service = await db.services.find_one({"id": service_id}, SERVICE_PROJECTION)
+    catalog_caches["services"].put(service)
+    await catalog_written("services")
+    publish_change("services", service)
+    return trusted_response(service)
 
 @app.delete("/api/services/{service_id}")
 async def delete_service(service_id: str):
     result = await db.services.delete_one({"id": service_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Service not found")
+    catalog_caches["services"].remove(service_id)
+    await catalog_written("services")
+    publish_deleted("services", service_id)
     return {"message": "Service deleted successfully"}
 
+# Idempotency keys. idempotency_keys holds one document per key:
+# {_id: key, fingerprint, sale_id, status: pending|done, status_code, body,
+# created_at, locked_until}. The first request inserts it as pending and
+# records the outcome; a retry with the same key and body gets the stored
+# outcome back, and a concurrent one waits for it. sale_id is fixed before the
+# sale is written, so a request taking over a dead key finds a sale that was
+# already committed instead of recording it again.
+idempotency_waiters: Dict[str, asyncio.Event] = {}
+
+def request_fingerprint(body: BaseModel) -> str:
+    return hashlib.sha256(orjson.dumps(body.model_dump(mode="json"), option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+def replay_response(record: dict) -> Response:
+    return TimedORJSONResponse(record["body"], status_code=record["status_code"],
+                               headers={"Idempotent-Replayed": "true"})
+
+# Returns the pending record when this request owns the key, or the done
+# record holding the stored outcome
+async def claim_idempotency_key(key: str, fingerprint: str) -> dict:
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = datetime.now()
+        lock = now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+        record = {"_id": key, "fingerprint": fingerprint, "sale_id": str(uuid.uuid4()), "status": "pending",
+                  "created_at": now, "locked_until": lock}
+        try:
+            await db.idempotency_keys.insert_one(record)
+            return record
+        except DuplicateKeyError:
+            pass
+        
+        record = await db.idempotency_keys.find_one({"_id": key})
+        if record is None:
+            # Expired or released in the meantime
+            continue
+        if record["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        if record["status"] == "done":
+            return record
+        
+        taken = await db.idempotency_keys.find_one_and_update(
+            {"_id": key, "status": "pending", "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": lock}},
+            return_document=ReturnDocument.AFTER
+        )
+        if taken:
+            sale = await db.sales.find_one({"id": taken["sale_id"]}, SALE_PROJECTION)
+            if sale:
+                return await finish_idempotency_key(key, 200, Sale(**sale).model_dump(mode="json"))
+            return taken
+        
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        waiter = idempotency_waiters.get(key)
+        if waiter:
+            try:
+                await asyncio.wait_for(waiter.wait(), IDEMPOTENCY_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+async def finish_idempotency_key(key: str, status_code: int, body) -> dict:
+    update = {"status": "done", "status_code": status_code, "body": body}
+    await db.idempotency_keys.update_one({"_id": key}, {"$set": update})
+    return update
+
+# Failures may come after the sale was committed, so the key is not deleted:
+# its lock is released and the next request takes it over, finding the sale
+# by sale_id if it exists
+async def release_idempotency_key(key: str):
+    try:
+        await db.idempotency_keys.update_one(
+            {"_id": key, "status": "pending"}, {"$set": {"locked_until": datetime.now()}}
+        )
+    except PyMongoError as error:
+        logger.warning("Could not release Idempotency-Key %s: %s", key, error)
+
+async def create_sale_once(key: str, sale: SaleCreate):
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key is longer than {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+    
+    record = await claim_idempotency_key(key, request_fingerprint(sale))
+    if record["status"] == "done":
+        return replay_response(record)
+    
+    waiter = idempotency_waiters[key] = asyncio.Event()
+    try:
+        sale_data = await record_sale(sale, record["sale_id"])
+        await finish_idempotency_key(key, 200, sale_data.model_dump(mode="json"))
+        return sale_data
+    except HTTPException as error:
+        # Client errors are part of the outcome: a retry gets the same answer.
+        # A stock conflict is not: nothing was written, and the same request
+        # may succeed once stock is back, so the key is released instead.
+        if error.status_code < 500 and error.status_code != 409:
+            await finish_idempotency_key(key, error.status_code, {"detail": error.detail})
+            raise
+        await release_idempotency_key(key)
+        raise
+    except BaseException:
+        await release_idempotency_key(key)
+        raise
+    finally:
+        waiter.set()
+        idempotency_waiters.pop(key, None)
+
 # Sales endpoints
 @app.get("/api/sales", response_model=List[Sale])
-async def get_sales():
-    sales = await db.sales.find().sort("created_at", -1).to_list(1000)
-    return sales
+async def get_sales(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None,
+                    fields: Optional[str] = None):
+    projection, model = select_fields(Sale, fields)
+    sales = await paginate(db.sales, response, limit, cursor, descending=True, projection=projection)
+    return trusted_response(sales, response, model)
 
 @app.post("/api/sales", response_model=Sale)
-async def create_sale(sale: SaleCreate):
+async def create_sale(sale: SaleCreate, idempotency_key: Optional[str] = Header(None)):
+    if idempotency_key:
+        return await create_sale_once(idempotency_key, sale)
+    return await record_sale(sale)
+
+async def record_sale(sale: SaleCreate, sale_id: Optional[str] = None) -> Sale:
+    # Check stock for every part up front so all shortages are reported at once
+    quantities = requested_part_quantities(sale.items)
+    if quantities:
+        shortages = await find_stock_shortages(quantities)
+        if shortages:
+            raise HTTPException(status_code=409, detail={"message": "Insufficient stock", "items": shortages})
+    
     # Generate sale number
     sale_number = await generate_sale_number()
     
@@ -339,6 +2744,7 @@ async def create_sale(sale: SaleCreate):
     
     # Create sale
     sale_data = Sale(
+        id=sale_id or str(uuid.uuid4()),
         sale_number=sale_number,
         date=datetime.now(),
         customer_id=sale.customer_id,
@@ -349,32 +2755,53 @@ async def create_sale(sale: SaleCreate):
         total=total
     )
     
-    # Update stock for parts
-    for item in sale.items:
-        if item.type == "part":
-            await db.parts.update_one(
-                {"id": item.id},
-                {"$inc": {"stock_quantity": -item.quantity}}
-            )
+    # Rollups and low-stock tracking run as jobs stored with the sale, so the
+    # response only waits for the sale and stock writes
+    jobs = [new_job("rollup_sale", {"sale_id": sale_data.id})]
+    if quantities:
+        jobs.append(new_job("sale_stock", {"part_ids": list(quantities)}))
+    
+    # Update stock for parts and record the sale
+    try:
+        await commit_sale(sale_data, quantities, jobs)
+    except InsufficientStock as error:
+        raise HTTPException(status_code=409, detail={"message": "Insufficient stock", "items": error.items})
     
-    await db.sales.insert_one(sale_data.model_dump())
+    if quantities:
+        catalog_caches["parts"].adjust_stock(quantities)
+        await catalog_written("parts")
+    await bump_version("sales")
+    schedule_jobs(jobs)
+    publish_change("sales", sale_data.model_dump())
     return sale_data
 
+@app.get("/api/sales/search", response_model=List[Sale])
+async def search_sales(q: str, limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT), fields: Optional[str] = None):
+    projection, model = select_fields(Sale, fields)
+    sales = await db.sales.find(
+        {"sale_number": prefix_query(q.strip())}, projection
+    ).sort("sale_number", -1).limit(limit).to_list(limit)
+    return trusted_response(sales, model=model)
+
 @app.get("/api/sales/{sale_id}", response_model=Sale)
-async def get_sale(sale_id: str):
-    sale = await db.sales.find_one({"id": sale_id})
+async def get_sale(sale_id: str, fields: Optional[str] = None):
+    projection, model = select_fields(Sale, fields)
+    sale = await db.sales.find_one({"id": sale_id}, projection)
     if not sale:
         raise HTTPException(status_code=404, detail="Sale not found")
-    return sale
+    return trusted_response(sale, model=model)
 
 # Settings endpoints
 @app.get("/api/settings")
-async def get_settings():
-    settings = await db.settings.find().to_list(1000)
+async def get_settings(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None):
+    settings = paginate_documents(list(settings_cache.values()), response, limit, cursor, sort_field="key")
     return {setting["key"]: setting["value"] for setting in settings}
 
 @app.put("/api/settings/{key}")
 async def update_setting(key: str, setting_update: SettingUpdate):
+    if key == "low_stock_threshold" and not valid_threshold(setting_update.value):
+        raise HTTPException(status_code=400, detail="low_stock_threshold must be an integer greater than or equal to 0")
+    
     result = await db.settings.update_one(
         {"key": key},
         {"$set": {"value": setting_update.value, "updated_at": datetime.now()}}
@@ -385,38 +2812,129 @@ async def update_setting(key: str, setting_update: SettingUpdate):
         setting = Setting(key=key, value=setting_update.value)
         await db.settings.insert_one(setting.model_dump())
     
+    # Reload this worker's cache now; other workers follow the version bump
+    await bump_version("settings")
+    await load_settings_cache()
+    publish_change("settings", {"key": key, "value": setting_update.value})
+    if key == "low_stock_threshold":
+        await rebuild_low_stock()
+    
     return {"message": "Setting updated successfully"}
 
 # Reports endpoints
 @app.get("/api/reports/sales")
-async def get_sales_report(start_date: str, end_date: str):
+async def get_sales_report(
+    start_date: str,
+    end_date: str,
+    response: Response,
+    include_sales: bool = False,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     try:
         start = datetime.strptime(start_date, "%Y-%m-%d")
         end = datetime.strptime(end_date + " 23:59:59", "%Y-%m-%d %H:%M:%S")
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
-    sales_data = await db.sales.find({
-        "date": {"$gte": start, "$lte": end}
-    }).to_list(1000)
-    
-    # Convert to Sale models to handle serialization
-    sales = [Sale(**sale) for sale in sales_data]
+    # Totals come from the daily rollups, one small row per day
+    report = {
+        "period": {"start": start_date, "end": end_date},
+        **await sum_sales_rollups(rollup_day(start), rollup_day(end)),
+    }
     
-    total_sales = len(sales)
-    total_revenue = sum(sale.total for sale in sales)
-    parts_revenue = sum(sale.subtotal_parts for sale in sales)
-    services_revenue = sum(sale.subtotal_services for sale in sales)
+    # The per-sale list is opt-in and paginated like the list endpoints
+    if include_sales:
+        date_range = {"date": {"$gte": start, "$lte": end}}
+        report["sales"] = await paginate(db.sales, response, limit, cursor, query=date_range, sort_field="date",
+                                         projection=SALE_PROJECTION)
     
-    return {
-        "period": {"start": start_date, "end": end_date},
-        "total_sales": total_sales,
-        "total_revenue": total_revenue,
-        "parts_revenue": parts_revenue,
-        "services_revenue": services_revenue,
-        "sales": [sale.model_dump() for sale in sales]
+    return trusted_response(report, response)
+
+@app.get("/api/reports/summary")
+async def get_sales_summary():
+    return await sum_sales_rollups()
+
+# Export columns: one row per sale item, with the sale fields repeated
+SALE_EXPORT_SALE_FIELDS = ["sale_number", "date", "customer_id", "customer_name", "customer_phone",
+                           "subtotal_parts", "subtotal_services", "total"]
+SALE_EXPORT_ITEM_FIELDS = [f"item_{field}" for field in SaleItem.model_fields]
+SALE_EXPORT_COLUMNS = SALE_EXPORT_SALE_FIELDS + SALE_EXPORT_ITEM_FIELDS
+
+def sale_export_rows(sale: dict):
+    customer_data = sale.get("customer_data") or {}
+    date_value = sale.get("date")
+    base = {
+        "sale_number": sale.get("sale_number"),
+        "date": date_value.isoformat() if isinstance(date_value, datetime) else date_value,
+        "customer_id": sale.get("customer_id"),
+        "customer_name": customer_data.get("name"),
+        "customer_phone": customer_data.get("phone"),
+        "subtotal_parts": sale.get("subtotal_parts"),
+        "subtotal_services": sale.get("subtotal_services"),
+        "total": sale.get("total"),
     }
+    # A sale without items still gets one row so it shows up in the export
+    items = sale.get("items") or [{}]
+    for item in items:
+        row = dict(base)
+        for field in SaleItem.model_fields:
+            row[f"item_{field}"] = item.get(field)
+        yield row
+
+# Same (date, id) order as the report pages, read straight off the date_id
+# index so the first rows go out before the whole period is read
+async def stream_sales_export(query: dict, export_format: str):
+    cursor = db.sales.find(query, {"_id": 0}, batch_size=EXPORT_BATCH_SIZE).sort([("date", 1), ("id", 1)])
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=SALE_EXPORT_COLUMNS)
+    
+    if export_format == "csv":
+        writer.writeheader()
+    
+    rows_in_buffer = 0
+    async for sale in cursor:
+        for row in sale_export_rows(sale):
+            if export_format == "csv":
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(row, ensure_ascii=False))
+                buffer.write("\n")
+            rows_in_buffer += 1
+        
+        # Flush once per batch so memory stays bounded by EXPORT_BATCH_SIZE
+        if rows_in_buffer >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows_in_buffer = 0
+    
+    remaining = buffer.getvalue()
+    if remaining:
+        yield remaining
+
+@app.get("/api/reports/sales/export")
+async def export_sales_report(start_date: str, end_date: str, format: str = "csv"):
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.strptime(end_date + " 23:59:59", "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Invalid format. Use csv or ndjson")
+    
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"vendas_{start_date}_{end_date}.{format}"
+    return StreamingResponse(
+        stream_sales_export({"date": {"$gte": start, "$lte": end}}, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    if sys.argv[1:] == ["rebuild-rollups"]:
+        asyncio.run(rebuild_sales_rollups())
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -2,13 +2,24 @@
 """
 Backend API Testing for Gestão Oficina Mecânica
 Tests all CRUD operations, sales flow, and reports
+
+With --load, replays a concurrent mix of catalog reads, customer searches,
+sale bursts and reports against a (local) server and writes per-endpoint
+latency percentiles, throughput and error rates to a JSON file.
 """
 
 import requests
+import argparse
+import asyncio
 import json
+import math
+import random
+import subprocess
 import sys
-from datetime import datetime, date
-from typing import Dict, Any, Optional
+import time
+import uuid
+from datetime import datetime, date, timedelta
+from typing import Dict, Any, List, Optional
 
 class OficinaAPITester:
     def __init__(self, base_url="https://garage-inventory.preview.emergentagent.com"):
@@ -47,7 +58,7 @@ class OficinaAPITester:
                 response = requests.delete(url, headers=headers, timeout=10)
             else:
                 return False, {}, 0
-
+            
             return response.status_code < 400, response.json() if response.content else {}, response.status_code
             
         except requests.exceptions.RequestException as e:
@@ -96,6 +107,11 @@ class OficinaAPITester:
         list_success = success and status == 200 and isinstance(data, list)
         self.log_test("List Customers", list_success, f"Status: {status}, Count: {len(data) if isinstance(data, list) else 0}")
         
+        # COUNT
+        success, data, status = self.make_request('GET', 'customers/count')
+        count_success = success and status == 200 and data.get('count', 0) >= 1
+        self.log_test("Count Customers", count_success, f"Status: {status}, Count: {data.get('count')}")
+        
         # UPDATE
         update_data = {"name": "João Silva Updated", "email": "joao.updated@email.com"}
         success, data, status = self.make_request('PUT', f'customers/{customer_id}', update_data)
@@ -103,7 +119,7 @@ class OficinaAPITester:
         self.log_test("Update Customer", update_success, f"Status: {status}")
         
         # DELETE (will be done in cleanup)
-        return create_success and read_success and list_success and update_success
+        return create_success and read_success and list_success and count_success and update_success
 
     def test_part_crud(self):
         """Test complete part CRUD operations"""
@@ -270,6 +286,17 @@ class OficinaAPITester:
             self.log_test("Stock Deduction Check", False, f"Could not retrieve updated part data")
             stock_deduction_valid = False
         
+        # OVERSELL: more units than the stock holds is refused and changes nothing
+        stock_now = final_stock if success else initial_stock - 2
+        oversell_data = {"items": [{**sale_data["items"][0], "quantity": stock_now + 1,
+                                    "subtotal": 30.00 * (stock_now + 1)}]}
+        success, data, status = self.make_request('POST', 'sales', oversell_data)
+        oversell_refused = status == 409
+        success, part_after, _ = self.make_request('GET', f'parts/{part_id}')
+        oversell_valid = oversell_refused and success and part_after.get('stock_quantity') == stock_now
+        self.log_test("Oversell Rejected", oversell_valid,
+                     f"Status: {status}, Stock: {part_after.get('stock_quantity')}, Expected: {stock_now}")
+        
         # READ SALE
         success, data, status = self.make_request('GET', f'sales/{sale_id}')
         read_success = success and status == 200 and data.get('id') == sale_id
@@ -281,7 +308,68 @@ class OficinaAPITester:
         self.log_test("List Sales", list_success, f"Status: {status}, Count: {len(data) if isinstance(data, list) else 0}")
         
         return (create_success and sale_number_valid and number_format_valid and 
-                totals_valid and stock_deduction_valid and read_success and list_success)
+                totals_valid and stock_deduction_valid and oversell_valid and read_success and list_success)
+
+    def post_sale_with_key(self, sale_data: Dict, key: str) -> tuple:
+        """POST a sale with an Idempotency-Key and return (status_code, response_data, replayed)"""
+        try:
+            response = requests.post(f"{self.base_url}/api/sales", json=sale_data,
+                                     headers={'Content-Type': 'application/json', 'Idempotency-Key': key}, timeout=10)
+        except requests.exceptions.RequestException as e:
+            print(f"Request error: {str(e)}")
+            return 0, {}, False
+        data = response.json() if response.content else {}
+        return response.status_code, data, response.headers.get('Idempotent-Replayed') == 'true'
+
+    def test_idempotent_sales(self):
+        """Test that a retried sale with the same Idempotency-Key is recorded once"""
+        print("\n🔍 Testing Idempotent Sales...")
+        
+        if not self.created_ids['parts']:
+            print("❌ Cannot test idempotent sales - missing required data (parts)")
+            return False
+        
+        part_id = self.created_ids['parts'][0]
+        success, part_data, status = self.make_request('GET', f'parts/{part_id}')
+        if not success:
+            self.log_test("Get Part Stock Before Idempotent Sale", False, f"Status: {status}")
+            return False
+        initial_stock = part_data.get('stock_quantity', 0)
+        
+        key = str(uuid.uuid4())
+        sale_data = {
+            "items": [{"type": "part", "id": part_id, "name": part_data.get('name', ''),
+                       "price": 30.00, "quantity": 1, "subtotal": 30.00}]
+        }
+        
+        # FIRST REQUEST
+        status, first, replayed = self.post_sale_with_key(sale_data, key)
+        first_success = status == 200 and 'id' in first and not replayed
+        self.log_test("Create Sale With Idempotency-Key", first_success, f"Status: {status}")
+        if not first_success:
+            return False
+        self.created_ids['sales'].append(first['id'])
+        
+        # RETRY WITH THE SAME KEY
+        status, retry, replayed = self.post_sale_with_key(sale_data, key)
+        replay_success = status == 200 and retry.get('id') == first['id'] and replayed
+        self.log_test("Replay Sale With Same Key", replay_success,
+                     f"Status: {status}, Same ID: {retry.get('id') == first['id']}, Replayed: {replayed}")
+        
+        # STOCK DECREMENTED ONCE
+        success, part_data, status = self.make_request('GET', f'parts/{part_id}')
+        final_stock = part_data.get('stock_quantity') if success else None
+        stock_success = final_stock == initial_stock - 1
+        self.log_test("Idempotent Sale Stock Deduction", stock_success,
+                     f"Initial: {initial_stock}, Final: {final_stock}, Expected: {initial_stock - 1}")
+        
+        # SAME KEY, DIFFERENT BODY
+        other_sale = {"items": [{**sale_data["items"][0], "quantity": 2, "subtotal": 60.00}]}
+        status, _, _ = self.post_sale_with_key(other_sale, key)
+        mismatch_success = status == 422
+        self.log_test("Reject Reused Key With Different Body", mismatch_success, f"Status: {status}")
+        
+        return first_success and replay_success and stock_success and mismatch_success
 
     def test_settings_operations(self):
         """Test settings get and update operations"""
@@ -311,7 +399,12 @@ class OficinaAPITester:
             verify_success = False
             self.log_test("Verify Setting Update", False, f"Could not retrieve settings")
         
-        return get_success and update_success and verify_success
+        # INVALID THRESHOLD (an empty number field arrives as null)
+        success, data, status = self.make_request('PUT', 'settings/low_stock_threshold', {"value": None})
+        reject_success = status == 400
+        self.log_test("Reject Invalid Threshold", reject_success, f"Status: {status}")
+        
+        return get_success and update_success and verify_success and reject_success
 
     def test_reports(self):
         """Test reports functionality"""
@@ -325,14 +418,23 @@ class OficinaAPITester:
         report_success = success and status == 200 and isinstance(data, dict)
         
         if report_success:
-            required_fields = ['period', 'total_sales', 'total_revenue', 'parts_revenue', 'services_revenue', 'sales']
-            fields_present = all(field in data for field in required_fields)
+            # The per-sale list is opt-in (include_sales) and paginated
+            required_fields = ['period', 'total_sales', 'total_revenue', 'parts_revenue', 'services_revenue']
+            fields_present = all(field in data for field in required_fields) and 'sales' not in data
             self.log_test("Sales Report", fields_present, 
                          f"Status: {status}, Total Sales: {data.get('total_sales', 0)}")
         else:
+            fields_present = False
             self.log_test("Sales Report", False, f"Status: {status}")
         
-        return report_success
+        success, data, status = self.make_request(
+            'GET', f'reports/sales?start_date={start_date}&end_date={end_date}&include_sales=true&limit=10'
+        )
+        sales_success = success and status == 200 and isinstance(data.get('sales'), list) and len(data['sales']) <= 10
+        self.log_test("Sales Report With Sales", sales_success,
+                     f"Status: {status}, Sales: {len(data.get('sales') or [])}")
+        
+        return report_success and fields_present and sales_success
 
     def cleanup_test_data(self):
         """Clean up created test data"""
@@ -374,6 +476,7 @@ class OficinaAPITester:
             
             # Sales operations (requires previous data)
             sales_tests = self.test_sales_operations()
+            idempotency_tests = self.test_idempotent_sales()
             
             # Settings and reports
             settings_tests = self.test_settings_operations()
@@ -397,9 +500,221 @@ class OficinaAPITester:
             print(f"💥 Unexpected error during testing: {str(e)}")
             return False
 
+class OficinaLoadTester:
+    """Concurrent load test replaying a weighted mix of API scenarios"""
+    
+    DEFAULT_MIX = {"catalog": 40, "search": 25, "sale": 15, "report": 20}
+
+    def __init__(self, base_url="http://localhost:8001", concurrency=10, duration=30.0,
+                 mix: Optional[Dict[str, int]] = None, sale_burst=5):
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.duration = duration
+        self.mix = mix or dict(self.DEFAULT_MIX)
+        self.sale_burst = sale_burst
+        self.samples: List[tuple] = []
+        self.fixtures = {'customers': [], 'parts': [], 'services': []}
+        self.run_tag = uuid.uuid4().hex[:6]
+
+    async def request(self, client, method: str, endpoint: str, label: str, **kwargs):
+        """Time one request and record (label, status, seconds); status 0 means a transport error"""
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, f"/api/{endpoint}", **kwargs)
+            status = response.status_code
+        except Exception:
+            response, status = None, 0
+        self.samples.append((label, status, time.perf_counter() - started))
+        return response
+
+    async def setup(self, client):
+        """Create the customers, parts and services the scenarios use"""
+        for index in range(20):
+            response = await client.post("/api/customers", json={
+                "name": f"Carga {self.run_tag} {index}", "phone": f"(11) 9{index:04d}-{random.randint(0, 9999):04d}"
+            })
+            response.raise_for_status()
+            self.fixtures['customers'].append(response.json())
+        for index in range(20):
+            response = await client.post("/api/parts", json={
+                "name": f"Peça Carga {index}", "reference_code": f"LOAD-{self.run_tag}-{index:03d}",
+                "cost_price": 10.0, "sale_price": 15.0, "stock_quantity": 1_000_000
+            })
+            response.raise_for_status()
+            self.fixtures['parts'].append(response.json())
+        for index in range(5):
+            response = await client.post("/api/services", json={"name": f"Serviço Carga {index}", "price": 50.0})
+            response.raise_for_status()
+            self.fixtures['services'].append(response.json())
+
+    async def cleanup(self, client):
+        """Delete the fixtures (sales have no delete endpoint and are kept)"""
+        for collection in ('customers', 'parts', 'services'):
+            for document in self.fixtures[collection]:
+                await client.delete(f"/api/{collection}/{document['id']}")
+
+    async def scenario_catalog(self, client):
+        collection = random.choice(['parts', 'services', 'customers'])
+        await self.request(client, 'GET', f'{collection}?limit=100', f"GET /api/{collection}")
+
+    async def scenario_search(self, client):
+        if random.random() < 0.5:
+            query = f"Carga {self.run_tag} {random.randint(0, 1)}"
+        else:
+            query = f"119{random.randint(0, 9)}"
+        await self.request(client, 'GET', 'customers/search', "GET /api/customers/search", params={"q": query})
+
+    async def scenario_sale(self, client):
+        async def create_sale():
+            part = random.choice(self.fixtures['parts'])
+            service = random.choice(self.fixtures['services'])
+            quantity = random.randint(1, 3)
+            await self.request(client, 'POST', 'sales', "POST /api/sales", json={
+                "customer_id": random.choice(self.fixtures['customers'])['id'],
+                "items": [
+                    {"type": "part", "id": part['id'], "name": part['name'], "price": part['sale_price'],
+                     "quantity": quantity, "subtotal": part['sale_price'] * quantity},
+                    {"type": "service", "id": service['id'], "name": service['name'], "price": service['price'],
+                     "quantity": 1, "subtotal": service['price']},
+                ]
+            })
+        await asyncio.gather(*(create_sale() for _ in range(self.sale_burst)))
+
+    async def scenario_report(self, client):
+        end = date.today()
+        days = random.choice([1, 30, 365])
+        if random.random() < 0.75:
+            await self.request(client, 'GET', 'reports/sales', "GET /api/reports/sales", params={
+                "start_date": (end - timedelta(days=days)).isoformat(), "end_date": end.isoformat()
+            })
+        else:
+            await self.request(client, 'GET', 'reports/summary', "GET /api/reports/summary")
+
+    async def worker(self, client, deadline: float):
+        scenarios = [getattr(self, f"scenario_{name}") for name in self.mix]
+        weights = list(self.mix.values())
+        while time.perf_counter() < deadline:
+            await random.choices(scenarios, weights)[0](client)
+
+    async def run(self) -> dict:
+        import httpx
+        
+        limits = httpx.Limits(max_connections=self.concurrency + self.sale_burst)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=30, limits=limits) as client:
+            await self.setup(client)
+            try:
+                started = time.perf_counter()
+                deadline = started + self.duration
+                await asyncio.gather(*(self.worker(client, deadline) for _ in range(self.concurrency)))
+                elapsed = time.perf_counter() - started
+            finally:
+                await self.cleanup(client)
+        return self.report(elapsed)
+
+    @staticmethod
+    def percentile(sorted_values: List[float], fraction: float) -> float:
+        """Nearest-rank percentile of an already sorted list"""
+        index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+        return sorted_values[index]
+
+    def summarize(self, samples: List[tuple], elapsed: float) -> dict:
+        latencies = sorted(seconds * 1000 for _, _, seconds in samples)
+        errors = sum(1 for _, status, _ in samples if status == 0 or status >= 400)
+        return {
+            "requests": len(samples),
+            "errors": errors,
+            "error_rate": round(errors / len(samples), 4),
+            "throughput_rps": round(len(samples) / elapsed, 2),
+            "mean_ms": round(sum(latencies) / len(latencies), 2),
+            "p50_ms": round(self.percentile(latencies, 0.50), 2),
+            "p95_ms": round(self.percentile(latencies, 0.95), 2),
+            "p99_ms": round(self.percentile(latencies, 0.99), 2),
+            "max_ms": round(latencies[-1], 2),
+        }
+
+    def report(self, elapsed: float) -> dict:
+        by_endpoint: Dict[str, List[tuple]] = {}
+        for sample in self.samples:
+            by_endpoint.setdefault(sample[0], []).append(sample)
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                    text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "commit": commit,
+            "base_url": self.base_url,
+            "concurrency": self.concurrency,
+            "duration_s": round(elapsed, 2),
+            "mix": self.mix,
+            "sale_burst": self.sale_burst,
+            "total": self.summarize(self.samples, elapsed) if self.samples else {},
+            "endpoints": {label: self.summarize(samples, elapsed) for label, samples in sorted(by_endpoint.items())},
+        }
+
+def print_load_report(report: dict, baseline: Optional[dict] = None):
+    """Print the per-endpoint table, with p95 change against a baseline report"""
+    print(f"\n📊 Load test: {report['concurrency']} workers for {report['duration_s']}s against {report['base_url']}")
+    print(f"{'endpoint':<28} {'reqs':>7} {'rps':>8} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8}")
+    rows = list(report['endpoints'].items()) + [("TOTAL", report['total'])]
+    for label, stats in rows:
+        if not stats:
+            continue
+        line = (f"{label:<28} {stats['requests']:>7} {stats['throughput_rps']:>8} "
+                f"{stats['error_rate'] * 100:>5.1f}% {stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}")
+        previous = (baseline or {}).get('endpoints', {}).get(label) if label != "TOTAL" else (baseline or {}).get('total')
+        if previous:
+            line += f"  p95 {stats['p95_ms'] - previous['p95_ms']:+.2f}ms"
+        print(line)
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """Parse "catalog=40,search=25,sale=15,report=20" into weights"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OficinaLoadTester.DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}")
+        mix[name] = int(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return mix
+
+def run_load_test(args) -> int:
+    """Run the load mode and write its JSON report"""
+    tester = OficinaLoadTester(args.url or "http://localhost:8001", args.concurrency, args.duration,
+                               args.mix, args.sale_burst)
+    report = asyncio.run(tester.run())
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    print_load_report(report, baseline)
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\n💾 Report written to {args.output}")
+    return 0 if report['total'] and report['total']['error_rate'] <= args.max_error_rate else 1
+
 def main():
     """Main test execution"""
-    tester = OficinaAPITester()
+    parser = argparse.ArgumentParser(description="Functional and load tests for the backend API")
+    parser.add_argument('--url', help="base URL (functional default: preview server, load default: http://localhost:8001)")
+    parser.add_argument('--load', action='store_true', help="run the concurrent load test instead of the functional tests")
+    parser.add_argument('--concurrency', type=int, default=10, help="concurrent workers (load mode)")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to run (load mode)")
+    parser.add_argument('--mix', type=parse_mix, default=None,
+                        help="scenario weights, e.g. catalog=40,search=25,sale=15,report=20")
+    parser.add_argument('--sale-burst', type=int, default=5, help="concurrent sales per sale scenario")
+    parser.add_argument('--output', default='load_test_results.json', help="JSON report path")
+    parser.add_argument('--baseline', help="previous JSON report to compare p95 latencies against")
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help="exit non-zero above this error rate")
+    args = parser.parse_args()
+    
+    if args.load:
+        return run_load_test(args)
+    
+    tester = OficinaAPITester(args.url) if args.url else OficinaAPITester()
     success = tester.run_all_tests()
     return 0 if success else 1
 
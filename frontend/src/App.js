@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { BrowserRouter as Router, Routes, Route, Link, useLocation } from 'react-router-dom';
 import axios from 'axios';
 import { Button } from './components/ui/button';
@@ -31,40 +31,115 @@ import {
 import './App.css';
 
 const API_BASE_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+const REPORT_PAGE_SIZE = 50;
+const LIST_PAGE_SIZE = 50;
+const SEARCH_DELAY_MS = 300;
+
+// List endpoints are cursor-paginated: the next page cursor comes back in the
+// X-Next-Cursor header. Lists load one page and fetch the next on demand.
+const getPage = (url, cursor) => axios.get(url, {
+  params: { limit: LIST_PAGE_SIZE, ...(cursor ? { cursor } : {}) }
+});
+
+// One page of a list plus loadMore() for the next one; reload() starts over
+// from the first page
+const usePagedList = (fetchPage) => {
+  const [items, setItems] = useState([]);
+  const [cursor, setCursor] = useState(null);
+  const [loading, setLoading] = useState(false);
+
+  const load = async (pageCursor) => {
+    setLoading(true);
+    try {
+      const response = await fetchPage(pageCursor);
+      setItems((current) => (pageCursor ? [...current, ...response.data] : response.data));
+      setCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error fetching list page:', error);
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  return {
+    items,
+    hasMore: Boolean(cursor),
+    loading,
+    reload: () => load(null),
+    loadMore: () => {
+      if (cursor && !loading) load(cursor);
+    }
+  };
+};
+
+const LoadMoreButton = ({ list }) => (
+  list.hasMore ? (
+    <div className="flex justify-center mt-4">
+      <Button type="button" variant="outline" onClick={list.loadMore} disabled={list.loading}>
+        {list.loading ? 'Carregando...' : 'Carregar mais'}
+      </Button>
+    </div>
+  ) : null
+);
+
+// Idempotency-Key for a sale. crypto.randomUUID needs a secure context, which
+// the app does not have when opened over plain http on the local network.
+const newIdempotencyKey = () => (
+  window.crypto && window.crypto.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}-${Math.random().toString(36).slice(2)}`
+);
 
 // API functions
 const api = {
   // Customers
-  getCustomers: () => axios.get(`${API_BASE_URL}/api/customers`),
+  getCustomers: (cursor) => getPage(`${API_BASE_URL}/api/customers`, cursor),
+  searchCustomers: (q) => axios.get(`${API_BASE_URL}/api/customers/search`, { params: { q } }),
+  getCustomerCount: () => axios.get(`${API_BASE_URL}/api/customers/count`),
   createCustomer: (data) => axios.post(`${API_BASE_URL}/api/customers`, data),
   updateCustomer: (id, data) => axios.put(`${API_BASE_URL}/api/customers/${id}`, data),
   deleteCustomer: (id) => axios.delete(`${API_BASE_URL}/api/customers/${id}`),
   
   // Parts
-  getParts: () => axios.get(`${API_BASE_URL}/api/parts`),
+  getParts: (cursor) => getPage(`${API_BASE_URL}/api/parts`, cursor),
+  searchParts: (q) => axios.get(`${API_BASE_URL}/api/parts/search`, { params: { q } }),
+  getPartCount: () => axios.get(`${API_BASE_URL}/api/parts/count`),
   createPart: (data) => axios.post(`${API_BASE_URL}/api/parts`, data),
   updatePart: (id, data) => axios.put(`${API_BASE_URL}/api/parts/${id}`, data),
   deletePart: (id) => axios.delete(`${API_BASE_URL}/api/parts/${id}`),
   getLowStockParts: () => axios.get(`${API_BASE_URL}/api/parts/low-stock`),
   
   // Services
-  getServices: () => axios.get(`${API_BASE_URL}/api/services`),
+  getServices: (cursor) => getPage(`${API_BASE_URL}/api/services`, cursor),
   createService: (data) => axios.post(`${API_BASE_URL}/api/services`, data),
   updateService: (id, data) => axios.put(`${API_BASE_URL}/api/services/${id}`, data),
   deleteService: (id) => axios.delete(`${API_BASE_URL}/api/services/${id}`),
   
   // Sales
-  getSales: () => axios.get(`${API_BASE_URL}/api/sales`),
-  createSale: (data) => axios.post(`${API_BASE_URL}/api/sales`, data),
+  getSales: (cursor) => getPage(`${API_BASE_URL}/api/sales`, cursor),
+  createSale: (data, idempotencyKey) => axios.post(`${API_BASE_URL}/api/sales`, data, {
+    headers: { 'Idempotency-Key': idempotencyKey }
+  }),
   getSale: (id) => axios.get(`${API_BASE_URL}/api/sales/${id}`),
+  getRecentSales: (limit) => axios.get(`${API_BASE_URL}/api/sales`, { params: { limit } }),
   
   // Settings
   getSettings: () => axios.get(`${API_BASE_URL}/api/settings`),
   updateSetting: (key, value) => axios.put(`${API_BASE_URL}/api/settings/${key}`, { value }),
   
   // Reports
-  getSalesReport: (startDate, endDate) => 
-    axios.get(`${API_BASE_URL}/api/reports/sales?start_date=${startDate}&end_date=${endDate}`)
+  getSalesSummary: () => axios.get(`${API_BASE_URL}/api/reports/summary`),
+  // Totals plus one page of the period's sales; the X-Next-Cursor header of
+  // a page fetches the next one
+  getSalesReport: (startDate, endDate, cursor) => axios.get(`${API_BASE_URL}/api/reports/sales`, {
+    params: {
+      start_date: startDate,
+      end_date: endDate,
+      include_sales: true,
+      limit: REPORT_PAGE_SIZE,
+      ...(cursor ? { cursor } : {})
+    }
+  })
 };
 
 // Navigation Component
@@ -128,17 +203,18 @@ const Dashboard = () => {
   useEffect(() => {
     const fetchDashboardData = async () => {
       try {
-        const [salesRes, customersRes, partsRes, lowStockRes] = await Promise.all([
-          api.getSales(),
-          api.getCustomers(),
-          api.getParts(),
+        const [summaryRes, salesRes, customersRes, partsRes, lowStockRes] = await Promise.all([
+          api.getSalesSummary(),
+          api.getRecentSales(5),
+          api.getCustomerCount(),
+          api.getPartCount(),
           api.getLowStockParts()
         ]);
 
         setStats({
-          totalSales: salesRes.data.length,
-          totalCustomers: customersRes.data.length,
-          totalParts: partsRes.data.length,
+          totalSales: summaryRes.data.total_sales,
+          totalCustomers: customersRes.data.count,
+          totalParts: partsRes.data.count,
           lowStockParts: lowStockRes.data.length
         });
 
@@ -274,25 +350,16 @@ const Dashboard = () => {
 
 // Sales Components
 const SalesPage = () => {
-  const [sales, setSales] = useState([]);
+  const sales = usePagedList(api.getSales);
   const [showNewSaleDialog, setShowNewSaleDialog] = useState(false);
 
   useEffect(() => {
-    fetchSales();
+    sales.reload();
   }, []);
 
-  const fetchSales = async () => {
-    try {
-      const response = await api.getSales();
-      setSales(response.data);
-    } catch (error) {
-      console.error('Error fetching sales:', error);
-    }
-  };
-
   const handleSaleCreated = () => {
     setShowNewSaleDialog(false);
-    fetchSales();
+    sales.reload();
   };
 
   return (
@@ -331,7 +398,7 @@ const SalesPage = () => {
               </TableRow>
             </TableHeader>
             <TableBody>
-              {sales.map((sale) => (
+              {sales.items.map((sale) => (
                 <TableRow key={sale.id}>
                   <TableCell className="font-mono">{sale.sale_number}</TableCell>
                   <TableCell>{sale.date}</TableCell>
@@ -354,6 +421,7 @@ const SalesPage = () => {
               ))}
             </TableBody>
           </Table>
+          <LoadMoreButton list={sales} />
         </CardContent>
       </Card>
     </div>
@@ -424,30 +492,64 @@ const printReceipt = (sale) => {
 
 const NewSaleForm = ({ onSaleCreated }) => {
   const [customers, setCustomers] = useState([]);
+  const [customerSearch, setCustomerSearch] = useState('');
   const [parts, setParts] = useState([]);
-  const [services, setServices] = useState([]);
+  const services = usePagedList(api.getServices);
   const [selectedCustomer, setSelectedCustomer] = useState('');
   const [saleItems, setSaleItems] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
+  const idempotencyKey = useRef(null);
+  // The chosen customer stays selectable when a new search no longer lists it
+  const chosenCustomer = useRef(null);
+
+  // A different sale needs a new key; retries of the same one reuse it
+  useEffect(() => {
+    idempotencyKey.current = null;
+  }, [saleItems, selectedCustomer]);
 
   useEffect(() => {
-    fetchFormData();
+    services.reload();
   }, []);
 
-  const fetchFormData = async () => {
-    try {
-      const [customersRes, partsRes, servicesRes] = await Promise.all([
-        api.getCustomers(),
-        api.getParts(),
-        api.getServices()
-      ]);
-      
-      setCustomers(customersRes.data);
-      setParts(partsRes.data);
-      setServices(servicesRes.data);
-    } catch (error) {
-      console.error('Error fetching form data:', error);
-    }
+  // The pickers ask the server: the search endpoints for a typed term, the
+  // first page of the list otherwise. A newer term discards older answers.
+  useEffect(() => {
+    let stale = false;
+    const timer = setTimeout(async () => {
+      try {
+        const term = customerSearch.trim();
+        const response = term ? await api.searchCustomers(term) : await api.getCustomers();
+        if (!stale) setCustomers(response.data);
+      } catch (error) {
+        console.error('Error fetching customers:', error);
+      }
+    }, SEARCH_DELAY_MS);
+    return () => {
+      stale = true;
+      clearTimeout(timer);
+    };
+  }, [customerSearch]);
+
+  useEffect(() => {
+    let stale = false;
+    const timer = setTimeout(async () => {
+      try {
+        const term = searchTerm.trim();
+        const response = term ? await api.searchParts(term) : await api.getParts();
+        if (!stale) setParts(response.data);
+      } catch (error) {
+        console.error('Error fetching parts:', error);
+      }
+    }, SEARCH_DELAY_MS);
+    return () => {
+      stale = true;
+      clearTimeout(timer);
+    };
+  }, [searchTerm]);
+
+  const selectCustomer = (customerId) => {
+    chosenCustomer.current = customers.find((customer) => customer.id === customerId) || chosenCustomer.current;
+    setSelectedCustomer(customerId);
   };
 
   const addItemToSale = (item, type) => {
@@ -515,20 +617,40 @@ const NewSaleForm = ({ onSaleCreated }) => {
         items: saleItems
       };
       
-      await api.createSale(saleData);
+      if (!idempotencyKey.current) {
+        idempotencyKey.current = newIdempotencyKey();
+      }
+      
+      // Requests that got no response are retried with the same key, so a
+      // sale that did reach the server is not recorded twice
+      for (let attempt = 1; ; attempt++) {
+        try {
+          await api.createSale(saleData, idempotencyKey.current);
+          break;
+        } catch (error) {
+          if (error.response || attempt >= 3) throw error;
+          await new Promise((resolve) => setTimeout(resolve, 1000 * attempt));
+        }
+      }
+      idempotencyKey.current = null;
       onSaleCreated();
     } catch (error) {
+      // A 4xx is a definite answer (the sale was not recorded), so the next
+      // submit is a new attempt with a new key
+      if (error.response && error.response.status < 500) {
+        idempotencyKey.current = null;
+      }
       console.error('Error creating sale:', error);
       alert('Erro ao criar venda');
     }
   };
 
   const totals = calculateTotals();
-  const filteredParts = parts.filter(part => 
-    part.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    part.reference_code.toLowerCase().includes(searchTerm.toLowerCase())
-  );
-  const filteredServices = services.filter(service => 
+  const customerOptions = chosenCustomer.current && chosenCustomer.current.id === selectedCustomer
+    && !customers.some((customer) => customer.id === selectedCustomer)
+    ? [chosenCustomer.current, ...customers]
+    : customers;
+  const filteredServices = services.items.filter(service => 
     service.name.toLowerCase().includes(searchTerm.toLowerCase())
   );
 
@@ -537,13 +659,20 @@ const NewSaleForm = ({ onSaleCreated }) => {
       {/* Customer Selection */}
       <div>
         <Label htmlFor="customer">Cliente (Opcional)</Label>
-        <Select value={selectedCustomer || undefined} onValueChange={setSelectedCustomer}>
+        <Input
+          id="customer-search"
+          placeholder="Buscar cliente por nome ou telefone..."
+          value={customerSearch}
+          onChange={(e) => setCustomerSearch(e.target.value)}
+          className="mb-2"
+        />
+        <Select value={selectedCustomer || undefined} onValueChange={selectCustomer}>
           <SelectTrigger>
             <SelectValue placeholder="Selecione um cliente" />
           </SelectTrigger>
           <SelectContent>
             <SelectItem value="none">Nenhum cliente</SelectItem>
-            {customers.map((customer) => (
+            {customerOptions.map((customer) => (
               <SelectItem key={customer.id} value={customer.id}>
                 {customer.name} - {customer.phone}
               </SelectItem>
@@ -559,7 +688,7 @@ const NewSaleForm = ({ onSaleCreated }) => {
           <Search className="absolute left-3 top-3 h-4 w-4 text-gray-400" />
           <Input
             id="search"
-            placeholder="Digite o nome da peça ou serviço..."
+            placeholder="Código da peça ou nome do serviço..."
             value={searchTerm}
             onChange={(e) => setSearchTerm(e.target.value)}
             className="pl-10"
@@ -586,7 +715,7 @@ const NewSaleForm = ({ onSaleCreated }) => {
                 </TableRow>
               </TableHeader>
               <TableBody>
-                {filteredParts.map((part) => (
+                {parts.map((part) => (
                   <TableRow key={part.id}>
                     <TableCell>{part.name}</TableCell>
                     <TableCell className="font-mono text-sm">{part.reference_code}</TableCell>
@@ -646,6 +775,7 @@ const NewSaleForm = ({ onSaleCreated }) => {
               </TableBody>
             </Table>
           </div>
+          <LoadMoreButton list={services} />
         </TabsContent>
       </Tabs>
 
@@ -730,7 +860,7 @@ const NewSaleForm = ({ onSaleCreated }) => {
 
 // Customer Components
 const CustomersPage = () => {
-  const [customers, setCustomers] = useState([]);
+  const customers = usePagedList(api.getCustomers);
   const [showDialog, setShowDialog] = useState(false);
   const [editingCustomer, setEditingCustomer] = useState(null);
 
@@ -738,14 +868,7 @@ const CustomersPage = () => {
     fetchCustomers();
   }, []);
 
-  const fetchCustomers = async () => {
-    try {
-      const response = await api.getCustomers();
-      setCustomers(response.data);
-    } catch (error) {
-      console.error('Error fetching customers:', error);
-    }
-  };
+  const fetchCustomers = () => customers.reload();
 
   const handleEdit = (customer) => {
     setEditingCustomer(customer);
@@ -808,7 +931,7 @@ const CustomersPage = () => {
               </TableRow>
             </TableHeader>
             <TableBody>
-              {customers.map((customer) => (
+              {customers.items.map((customer) => (
                 <TableRow key={customer.id}>
                   <TableCell className="font-semibold">{customer.name}</TableCell>
                   <TableCell>{customer.phone}</TableCell>
@@ -836,6 +959,7 @@ const CustomersPage = () => {
               ))}
             </TableBody>
           </Table>
+          <LoadMoreButton list={customers} />
         </CardContent>
       </Card>
     </div>
@@ -933,7 +1057,7 @@ const CustomerForm = ({ customer, onClose }) => {
 
 // Parts Page (similar structure for services)
 const PartsPage = () => {
-  const [parts, setParts] = useState([]);
+  const parts = usePagedList(api.getParts);
   const [showDialog, setShowDialog] = useState(false);
   const [editingPart, setEditingPart] = useState(null);
 
@@ -941,14 +1065,7 @@ const PartsPage = () => {
     fetchParts();
   }, []);
 
-  const fetchParts = async () => {
-    try {
-      const response = await api.getParts();
-      setParts(response.data);
-    } catch (error) {
-      console.error('Error fetching parts:', error);
-    }
-  };
+  const fetchParts = () => parts.reload();
 
   const handleEdit = (part) => {
     setEditingPart(part);
@@ -1012,7 +1129,7 @@ const PartsPage = () => {
               </TableRow>
             </TableHeader>
             <TableBody>
-              {parts.map((part) => (
+              {parts.items.map((part) => (
                 <TableRow key={part.id}>
                   <TableCell className="font-semibold">{part.name}</TableCell>
                   <TableCell className="font-mono text-sm">{part.reference_code}</TableCell>
@@ -1045,6 +1162,7 @@ const PartsPage = () => {
               ))}
             </TableBody>
           </Table>
+          <LoadMoreButton list={parts} />
         </CardContent>
       </Card>
     </div>
@@ -1183,7 +1301,7 @@ const PartForm = ({ part, onClose }) => {
 
 // Services Page
 const ServicesPage = () => {
-  const [services, setServices] = useState([]);
+  const services = usePagedList(api.getServices);
   const [showDialog, setShowDialog] = useState(false);
   const [editingService, setEditingService] = useState(null);
 
@@ -1191,14 +1309,7 @@ const ServicesPage = () => {
     fetchServices();
   }, []);
 
-  const fetchServices = async () => {
-    try {
-      const response = await api.getServices();
-      setServices(response.data);
-    } catch (error) {
-      console.error('Error fetching services:', error);
-    }
-  };
+  const fetchServices = () => services.reload();
 
   const handleEdit = (service) => {
     setEditingService(service);
@@ -1260,7 +1371,7 @@ const ServicesPage = () => {
               </TableRow>
             </TableHeader>
             <TableBody>
-              {services.map((service) => (
+              {services.items.map((service) => (
                 <TableRow key={service.id}>
                   <TableCell className="font-semibold">{service.name}</TableCell>
                   <TableCell className="max-w-64 truncate">{service.description || '-'}</TableCell>
@@ -1287,6 +1398,7 @@ const ServicesPage = () => {
               ))}
             </TableBody>
           </Table>
+          <LoadMoreButton list={services} />
         </CardContent>
       </Card>
     </div>
@@ -1384,6 +1496,8 @@ const ReportsPage = () => {
   const [startDate, setStartDate] = useState('');
   const [endDate, setEndDate] = useState('');
   const [salesReport, setSalesReport] = useState(null);
+  const [salesCursor, setSalesCursor] = useState(null);
+  const [loadingSales, setLoadingSales] = useState(false);
   const [lowStockParts, setLowStockParts] = useState([]);
 
   useEffect(() => {
@@ -1404,11 +1518,28 @@ const ReportsPage = () => {
     try {
       const response = await api.getSalesReport(startDate, endDate);
       setSalesReport(response.data);
+      setSalesCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Error fetching sales report:', error);
     }
   };
 
+  // Sales of the period are loaded a page at a time, when asked for
+  const loadMoreSales = async () => {
+    if (!salesCursor || loadingSales) return;
+    
+    setLoadingSales(true);
+    try {
+      const response = await api.getSalesReport(salesReport.period.start, salesReport.period.end, salesCursor);
+      setSalesReport((report) => ({ ...report, sales: [...report.sales, ...response.data.sales] }));
+      setSalesCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error fetching sales report:', error);
+    } finally {
+      setLoadingSales(false);
+    }
+  };
+
   const fetchLowStockParts = async () => {
     try {
       const response = await api.getLowStockParts();
@@ -1523,6 +1654,13 @@ const ReportsPage = () => {
                           ))}
                         </TableBody>
                       </Table>
+                      {salesCursor && (
+                        <div className="flex justify-center mt-4">
+                          <Button variant="outline" onClick={loadMoreSales} disabled={loadingSales}>
+                            {loadingSales ? 'Carregando...' : 'Carregar mais vendas'}
+                          </Button>
+                        </div>
+                      )}
                     </CardContent>
                   </Card>
                 </div>
@@ -0,0 +1,11 @@
+import os
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+def mongod_available() -> bool:
+    try:
+        MongoClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"), serverSelectionTimeoutMS=1000).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
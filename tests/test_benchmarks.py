@@ -0,0 +1,103 @@
+"""
+Handler benchmarks against a seeded local mongod
+
+Seeds oficina_mecanica_bench with backend/seed_data.py (reused while the
+seed volumes match) and times the handlers through the ASGI app. Needs
+pytest-benchmark and a running mongod; skipped otherwise.
+
+    BENCH_SCALE=0.01 pytest tests/test_benchmarks.py --benchmark-autosave
+    pytest-benchmark compare
+
+BENCH_SCALE is the fraction of the production volumes (200k customers,
+20k parts, 2M sales); results are saved under .benchmarks/ for comparison.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+pytest.importorskip("pytest_benchmark")
+
+from pymongo import MongoClient
+
+from tests.conftest import mongod_available
+
+pytestmark = pytest.mark.skipif(not mongod_available(), reason="needs a running mongod")
+
+BENCH_SCALE = float(os.environ.get("BENCH_SCALE", "0.01"))
+BENCH_DAYS = int(os.environ.get("BENCH_DAYS", "365"))
+BENCH_ROUNDS = int(os.environ.get("BENCH_ROUNDS", "20"))
+
+@pytest.fixture(scope="module")
+def bench():
+    import httpx
+    import seed_data
+    import server
+
+    # seed_database and the fixture point the module database at the bench
+    # one; it is put back afterwards so later tests see the application's
+    application_db = server.db
+    loop = asyncio.new_event_loop()
+    try:
+        volumes = seed_data.scaled_volumes(BENCH_SCALE)
+        info = MongoClient(server.MONGO_URL)[seed_data.SEED_DATABASE].seed_info.find_one({"_id": "seed"})
+        if not info or info["volumes"] != volumes or info["days"] != BENCH_DAYS:
+            loop.run_until_complete(seed_data.seed_database(volumes=volumes, days=BENCH_DAYS, drop=True))
+        server.db = server.client[seed_data.SEED_DATABASE]
+        loop.run_until_complete(server.startup_event())
+
+        # identity keeps the compressed-body cache out of the measurements
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench",
+                                   headers={"Accept-Encoding": "identity"})
+        part = loop.run_until_complete(server.db.parts.find_one({}, {"_id": 0}))
+        loop.run_until_complete(server.db.parts.update_one({"id": part["id"]}, {"$set": {"stock_quantity": 10 ** 9}}))
+
+        def run(coroutine_function, *args, **kwargs):
+            return loop.run_until_complete(coroutine_function(*args, **kwargs))
+
+        yield {"run": run, "client": client, "server": server, "part": part}
+
+        loop.run_until_complete(client.aclose())
+        loop.run_until_complete(server.shutdown_event())
+    finally:
+        loop.close()
+        server.db = application_db
+
+def timed_request(benchmark, bench, method: str, url: str, **kwargs):
+    client = bench["client"]
+
+    def request():
+        response = bench["run"](client.request, method, url, **kwargs)
+        assert response.status_code == 200, response.text
+        return response
+
+    return benchmark.pedantic(request, rounds=BENCH_ROUNDS, warmup_rounds=1)
+
+@pytest.mark.parametrize("collection", ["customers", "parts", "services", "sales"])
+def test_list_first_page(benchmark, bench, collection):
+    timed_request(benchmark, bench, "GET", f"/api/{collection}", params={"limit": 100})
+
+@pytest.mark.parametrize("days", [1, 30, 365])
+def test_sales_report(benchmark, bench, days):
+    end = date.today()
+    timed_request(benchmark, bench, "GET", "/api/reports/sales", params={
+        "start_date": (end - timedelta(days=days - 1)).isoformat(),
+        "end_date": end.isoformat(),
+        "include_sales": "true",
+    })
+
+def test_generate_sale_number(benchmark, bench):
+    benchmark.pedantic(bench["run"], args=(bench["server"].generate_sale_number,), rounds=BENCH_ROUNDS * 5,
+                       warmup_rounds=1)
+
+def test_create_sale(benchmark, bench):
+    part = bench["part"]
+    timed_request(benchmark, bench, "POST", "/api/sales", json={"items": [{
+        "type": "part", "id": part["id"], "name": part["name"], "price": part["sale_price"],
+        "quantity": 1, "subtotal": part["sale_price"],
+    }]})
@@ -0,0 +1,61 @@
+import asyncio
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import server
+
+# Stands in for a Starlette request: the body arrives in chunks of chunk_size
+class StreamedBody:
+    def __init__(self, body: bytes, chunk_size: int):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            yield self.body[start:start + self.chunk_size]
+
+def import_rows(body: bytes, import_format: str, chunk_size: int) -> list:
+    async def collect():
+        return [row async for row in server.iter_import_rows(StreamedBody(body, chunk_size), import_format)]
+    return asyncio.run(collect())
+
+CSV_BODY = (
+    'name,reference_code,cost_price,sale_price,stock_quantity\r\n'
+    'Mangueira 3/8",REF-A,1,2,10\r\n'
+    '"Filtro ""Premium"", óleo",REF-B,3,4,5\r\n'
+    '"Junta\r\nmultilinha",REF-C,5,6,7\r\n'
+    '\r\n'
+    'Vela,REF-D,7,8,9'
+).encode()
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 4096])
+def test_csv_rows_keep_quotes_and_crlf(chunk_size):
+    rows = import_rows(CSV_BODY, "csv", chunk_size)
+
+    assert [(number, error) for number, _, error in rows] == [(1, None), (2, None), (3, None), (4, None)]
+    names = [row["name"] for _, row, _ in rows]
+    assert names == ['Mangueira 3/8"', 'Filtro "Premium", óleo', "Junta\r\nmultilinha", "Vela"]
+    assert rows[0][1] == {"name": 'Mangueira 3/8"', "reference_code": "REF-A", "cost_price": "1",
+                          "sale_price": "2", "stock_quantity": "10"}
+
+def test_malformed_csv_record_is_a_row_error():
+    too_long = "x" * (csv.field_size_limit() + 1)
+    body = f"name,reference_code\n{too_long},REF-A\nVela,REF-B\n".encode()
+
+    rows = import_rows(body, "csv", 4096)
+
+    assert rows[0][0] == 1 and rows[0][1] is None and "field larger than field limit" in rows[0][2]
+    assert rows[1] == (2, {"name": "Vela", "reference_code": "REF-B"}, None)
+
+def test_ndjson_lines_split_across_chunks():
+    body = b'{"name": "A"}\r\n\n{"name": "B"}\nnot json\n'
+
+    rows = import_rows(body, "ndjson", 3)
+
+    assert [(number, row) for number, row, _ in rows] == [(1, {"name": "A"}), (2, {"name": "B"}), (3, None)]
+    assert rows[2][2]
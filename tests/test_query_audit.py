@@ -0,0 +1,23 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from tests.conftest import mongod_available
+
+pytestmark = pytest.mark.skipif(not mongod_available(), reason="needs a running mongod")
+
+def test_every_query_shape_uses_an_index():
+    import query_audit
+    import server
+    application_db = server.db
+    
+    results = asyncio.run(query_audit.run_audit(documents=50))
+    
+    assert server.db is application_db
+    assert {result["collection"] for result in results} >= {"customers", "parts", "services", "sales", "jobs"}
+    scans = {result["name"]: result["plan"] for result in results if not result["ok"]}
+    assert scans == {}